@@ -1,18 +1,102 @@
 import os
+import re
+import sys
+import atexit
+import copy
 import json
-import pandas as pd
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory
+import csv
+import gzip
+import io
+import zipfile
+import zlib
+import unicodedata
+import base64
+import hashlib
+import time
+import tempfile
+import threading
+import sqlite3
+import gc
+import importlib
+import multiprocessing
+import subprocess
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import click
+from flask.cli import AppGroup
+from flask import Flask, Response, g, render_template, request, redirect, url_for, flash, make_response, send_from_directory, abort, jsonify, has_request_context, stream_with_context
+from markupsafe import Markup
 from datetime import datetime
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from bs4 import BeautifulSoup
 from functools import wraps
+from werkzeug.security import safe_join
+
+try:
+    import fcntl  # locks entre processos (gunicorn); indisponível no Windows
+except ImportError:
+    fcntl = None
+
+try:
+    import brotli  # opcional: gera a variante .br das páginas dos pacientes
+except ImportError:
+    brotli = None
+
+class LazyModule:
+    """Módulo importado no primeiro acesso a um atributo.
+
+    pandas e NumPy custam meio segundo e dezenas de MB por worker, mas só são usados pelo CSV de
+    usuários, pela importação em lote e pelas métricas de evolução.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+
+    def __getattr__(self, attr):
+        # Só chamado enquanto o atributo não está no __dict__: depois do import, o acesso é direto.
+        module = importlib.import_module(self.__dict__['_lazy_name'])
+        self.__dict__.update(vars(module))
+        return getattr(module, attr)
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
 
 # --- INICIALIZAÇÃO E CONFIGURAÇÃO DO FLASK ---
-app = Flask(__name__)
+# Pasta de dados (instance/) e CSV de usuários podem apontar para outro lugar, ex.: os dados sintéticos dos benchmarks
+app = Flask(__name__, instance_path=os.path.abspath(os.environ['PORTAL_INSTANCE_PATH']) if os.environ.get('PORTAL_INSTANCE_PATH') else None)
 app.config['SECRET_KEY'] = 'uma-chave-secreta-muito-segura-e-dificil'
-USER_DB_PATH = 'patients.csv'
+USER_DB_PATH = os.environ.get('PORTAL_USER_DB', 'patients.csv')
+# Backend de armazenamento dos usuários: 'csv' (padrão) ou 'sqlite'
+app.config['STORAGE_BACKEND'] = os.environ.get('PORTAL_STORAGE', 'csv')
+USER_SQLITE_PATH = os.path.join(app.instance_path, 'patients.db')
+PLAN_SUMMARY_PATH = os.path.join(app.instance_path, 'plan_summaries.db')
+LEGACY_PLAN_SUMMARY_PATH = os.path.join(app.instance_path, 'plan_summaries.json')
+METRICS_FOLDER = os.path.join(app.instance_path, 'metrics')
+LOCKS_FOLDER = os.path.join(app.instance_path, 'locks')
+PLAN_HISTORY_FOLDER = os.path.join(app.instance_path, 'plan_history')
+SEARCH_INDEX_PATH = os.path.join(app.instance_path, 'search.db')
+os.makedirs(LOCKS_FOLDER, exist_ok=True)
+# Gravação dos planos: 'sync' (na própria requisição) ou 'write-behind' (fila em segundo plano)
+app.config['PERSISTENCE_MODE'] = os.environ.get('PORTAL_PERSISTENCE', 'sync')
+# Durabilidade: 'fsync' (cada arquivo), 'batch' (JSON do plano a cada salvamento; página e derivados com um fsync
+# por lote do write-behind) ou 'none' (fica a cargo do SO)
+app.config['PERSISTENCE_DURABILITY'] = os.environ.get('PORTAL_DURABILITY', 'fsync')
+# Páginas dos pacientes: 'static' grava o HTML no salvamento; 'dynamic' renderiza sob demanda a partir do JSON
+app.config['PLAN_RENDER_MODE'] = os.environ.get('PORTAL_PLAN_RENDER', 'static')
+app.config['PLAN_RENDER_CACHE_SIZE'] = int(os.environ.get('PORTAL_PLAN_RENDER_CACHE', '256'))
+# Métricas por worker (agregadas em /metrics) e, opcionalmente, perfis das requisições lentas
+TELEMETRY_FOLDER = os.path.join(app.instance_path, 'telemetry')
+PROFILES_FOLDER = os.path.join(app.instance_path, 'profiles')
+os.makedirs(TELEMETRY_FOLDER, exist_ok=True)
+# Requisições acima deste tempo (ms) têm o perfil gravado em instance/profiles; 0 desliga o profiler
+app.config['PROFILE_SLOW_MS'] = int(os.environ.get('PORTAL_PROFILE_SLOW_MS', '0'))
+app.config['PROFILE_INTERVAL_MS'] = float(os.environ.get('PORTAL_PROFILE_INTERVAL_MS', '5'))
 PATIENT_DATA_FOLDER = os.path.join(app.instance_path, 'patient_data')
 os.makedirs(PATIENT_DATA_FOLDER, exist_ok=True)
+# Planos de pacientes arquivados ficam fora de PATIENT_DATA_FOLDER, num pacote comprimido por paciente
+COLD_STORAGE_FOLDER = os.path.join(app.instance_path, 'cold_storage')
+os.makedirs(COLD_STORAGE_FOLDER, exist_ok=True)
 
 # --- CONFIGURAÇÃO DO FLASK-LOGIN ---
 login_manager = LoginManager()
@@ -28,14 +112,985 @@ class User(UserMixin):
         self.password = password
         self.role = role
 
+# --- INSTRUMENTAÇÃO (MÉTRICAS E PROFILER) ---
+# Limites (em segundos) dos histogramas de latência.
+TELEMETRY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TELEMETRY_HELP = {
+    'portal_requests_total': ('counter', 'Requisições atendidas, por rota, método e status.'),
+    'portal_request_duration_seconds': ('histogram', 'Latência das requisições, por rota e método.'),
+    'portal_csv_reads_total': ('counter', 'Leituras (parse) do CSV de usuários.'),
+    'portal_csv_writes_total': ('counter', 'Regravações do CSV de usuários.'),
+    'portal_bytes_read_total': ('counter', 'Bytes lidos do disco, por tipo de arquivo.'),
+    'portal_bytes_written_total': ('counter', 'Bytes gravados em disco, por tipo de arquivo.'),
+    'portal_html_parses_total': ('counter', 'Extrações do JSON embutido em páginas antigas, por método.'),
+    'portal_render_duration_seconds': ('histogram', 'Tempo de renderização das páginas dos planos.'),
+    'portal_cache_hits_total': ('counter', 'Acertos de cache, por cache.'),
+    'portal_cache_misses_total': ('counter', 'Faltas de cache, por cache.'),
+    'portal_slow_request_profiles_total': ('counter', 'Perfis gravados de requisições lentas.'),
+    'portal_write_queue_submitted_total': ('counter', 'Gravações enviadas à fila do write-behind.'),
+    'portal_write_queue_coalesced_total': ('counter', 'Gravações do write-behind agrupadas com uma pendente da mesma chave.'),
+    'portal_write_queue_batches_total': ('counter', 'Lotes gravados pela fila do write-behind.'),
+}
+
+class Telemetry:
+    """Contadores e histogramas do processo, gravados em instance/telemetry/<pid>.json.
+
+    Cada worker do gunicorn grava o próprio arquivo; /metrics soma os arquivos de todos eles. Os arquivos
+    de processos encerrados são somados a retired.json e removidos, para que os totais nunca diminuam.
+    Só processos que atendem requisições registram algo: os comandos da CLI não gravam telemetria.
+    """
+
+    FLUSH_INTERVAL = 1.0
+    RETIRED_FILE = 'retired.json'
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._dirty = False
+        self._thread = None
+        self._pid = os.getpid()
+        # Identifica este processo no arquivo: um PID reaproveitado não pode sobrescrever os totais do anterior.
+        self._started = time.time_ns()
+        self._claimed = False
+
+    def _after_fork(self):
+        # O filho de um fork começa do zero, senão os valores do pai seriam contados duas vezes. Os locks
+        # também são recriados: a thread de gravação do pai não existe no filho e pode ter ficado com um deles.
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counters, self._histograms = {}, {}
+        self._dirty = False
+        self._thread = None
+        self._pid = os.getpid()
+        self._started = time.time_ns()
+        self._claimed = False
+
+    def _mark_dirty(self):
+        self._dirty = True
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        # Grava os valores do processo no máximo uma vez por FLUSH_INTERVAL, fora das requisições.
+        while True:
+            time.sleep(self.FLUSH_INTERVAL)
+            if self._dirty:
+                self.flush()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._mark_dirty()
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._mark_dirty()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * len(TELEMETRY_BUCKETS) + [0.0, 0]
+            bucket = bisect_left(TELEMETRY_BUCKETS, seconds)
+            if bucket < len(TELEMETRY_BUCKETS):
+                histogram[bucket] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            self._dirty = False
+            return {
+                'started': self._started,
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, labels, values] for (name, labels), values in self._histograms.items()],
+            }
+
+    def _path(self, pid):
+        return os.path.join(self.folder, f"{pid}.json")
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def flush(self):
+        """Grava os valores do processo em <pid>.json."""
+        if not self.enabled or self._pid != os.getpid():
+            return
+        path = self._path(self._pid)
+        # Sem fsync nem atomic_write: são métricas, e a gravação não deve contar a si mesma.
+        tmp_path = f"{path}.tmp"
+        with self._flush_lock:
+            if not self._claimed:
+                # Arquivo deixado por um processo antigo com o mesmo PID: os totais dele vão para retired.json.
+                previous = self._read(path)
+                if previous is not None and previous.get('started') != self._started:
+                    self.retire(self._pid, previous.get('started'))
+                self._claimed = True
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+
+    def retire(self, pid, started=None):
+        """Soma o arquivo de um processo encerrado a retired.json e o remove.
+
+        Com `started`, só retira o arquivo se ele ainda for do mesmo processo (o PID pode ter sido reaproveitado).
+        """
+        path = self._path(pid)
+        with file_lock('telemetry:' + self.folder):
+            data = self._read(path)
+            if data is None or (started is not None and data.get('started') != started):
+                return
+            counters, histograms = {}, {}
+            retired_path = os.path.join(self.folder, self.RETIRED_FILE)
+            for source in (self._read(retired_path), data):
+                if source is not None:
+                    self._merge(counters, histograms, source)
+            tmp_path = f"{retired_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+                           'histograms': [[name, labels, values] for (name, labels), values in histograms.items()]}, f)
+            os.replace(tmp_path, retired_path)
+            os.remove(path)
+
+    def prune(self):
+        """Retira os arquivos de processos que não existem mais (ex.: workers reciclados pelo gunicorn)."""
+        if os.name != 'posix':
+            return  # no Windows, os.kill(pid, 0) encerraria o processo
+        with os.scandir(self.folder) as entries:
+            pids = [int(entry.name[:-5]) for entry in entries
+                    if entry.name.endswith('.json') and entry.name[:-5].isdigit()]
+        for pid in pids:
+            if pid == os.getpid():
+                continue
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                data = self._read(self._path(pid))
+                if data is not None:
+                    self.retire(pid, data.get('started'))
+            except PermissionError:
+                pass  # existe, mas é de outro usuário
+
+    @staticmethod
+    def _merge(counters, histograms, data):
+        for name, labels, value in data['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in data['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            current = histograms.get(key)
+            histograms[key] = values if current is None else [a + b for a, b in zip(current, values)]
+
+    def collect(self):
+        """Soma os valores gravados por todos os workers, inclusive os já encerrados."""
+        self.flush()
+        self.prune()
+        counters, histograms = {}, {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.json'):
+                    continue
+                data = self._read(entry.path)
+                if data is not None:
+                    self._merge(counters, histograms, data)
+        return counters, histograms
+
+    def render(self):
+        """Métricas agregadas no formato texto do Prometheus."""
+        counters, histograms = self.collect()
+        series = {}
+        for (name, labels), value in counters.items():
+            series.setdefault(name, []).append(f"{name}{_prometheus_labels(labels)} {value}")
+        for (name, labels), values in histograms.items():
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(TELEMETRY_BUCKETS, values):
+                cumulative += count
+                lines.append(f"{name}_bucket{_prometheus_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_prometheus_labels(labels + (('le', '+Inf'),))} {values[-1]}")
+            lines.append(f"{name}_sum{_prometheus_labels(labels)} {values[-2]}")
+            lines.append(f"{name}_count{_prometheus_labels(labels)} {values[-1]}")
+        output = []
+        for name in sorted(series):
+            kind, description = TELEMETRY_HELP.get(name, ('untyped', name))
+            output += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"] + sorted(series[name])
+        return "\n".join(output) + "\n"
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    escaped = (key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+               for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+def file_kind(path):
+    # A extensão (csv, json, html, gz, zip...) mantém poucas séries nos contadores de bytes.
+    return os.path.splitext(path)[1].lstrip('.') or 'other'
+
+def record_read(path, nbytes):
+    telemetry.inc('portal_bytes_read_total', nbytes, kind=file_kind(path))
+
+telemetry = Telemetry(TELEMETRY_FOLDER)
+atexit.register(telemetry.flush)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=telemetry._after_fork)
+
+class SlowRequestProfiler:
+    """Profiler por amostragem (opt-in): uma thread coleta as pilhas das requisições em andamento
+    e grava, no formato 'folded' dos flame graphs, o perfil das que passarem do limite."""
+
+    def __init__(self, folder, threshold_ms, interval_ms):
+        self.folder = folder
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._active = {}
+        self._thread = None
+
+    def _ensure_sampler(self):
+        # Como na fila do write-behind, a thread é recriada no processo filho após um fork.
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    if stack:
+                        key = ";".join(reversed(stack))
+                        samples[key] = samples.get(key, 0) + 1
+
+    def start(self):
+        with self._lock:
+            self._ensure_sampler()
+            self._active[threading.get_ident()] = {}
+
+    def stop(self, label, duration):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if not samples or duration < self.threshold:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        name = re.sub(r'[^\w.-]+', '_', label).strip('_') or 'request'
+        path = os.path.join(self.folder, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{name}-{duration * 1000:.0f}ms.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(samples.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+        telemetry.inc('portal_slow_request_profiles_total')
+
+def process_memory():
+    """Memória residente do processo e a parte compartilhada com outros (ex.: workers e o mestre), em bytes.
+
+    Lê /proc/self/smaps_rollup (Linux); em outros sistemas devolve None nos dois campos.
+    """
+    memory = {'rss': None, 'shared': None}
+    try:
+        with open('/proc/self/smaps_rollup', encoding='ascii') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key == 'Rss':
+                    memory['rss'] = int(value.split()[0]) * 1024
+                elif key in ('Shared_Clean', 'Shared_Dirty'):
+                    memory['shared'] = (memory['shared'] or 0) + int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return memory
+
+slow_request_profiler = (SlowRequestProfiler(PROFILES_FOLDER, app.config['PROFILE_SLOW_MS'], app.config['PROFILE_INTERVAL_MS'])
+                         if app.config['PROFILE_SLOW_MS'] > 0 else None)
+if slow_request_profiler and hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=slow_request_profiler._after_fork)
+
+def request_route_label():
+    # A regra da rota (e não a URL) mantém poucas séries: /edit/<username> em vez de um valor por paciente.
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_timer():
+    # A telemetria começa na primeira requisição; comandos da CLI e o mestre do gunicorn não gravam nada.
+    telemetry.enabled = True
+    g.request_started = time.perf_counter()
+    if slow_request_profiler:
+        slow_request_profiler.start()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        duration = time.perf_counter() - started
+        route = request_route_label()
+        telemetry.inc('portal_requests_total', route=route, method=request.method, status=response.status_code)
+        telemetry.observe('portal_request_duration_seconds', duration, route=route, method=request.method)
+        if response.status_code == 304:
+            telemetry.inc('portal_cache_hits_total', cache='http_304')
+    return response
+
+@app.teardown_request
+def finish_request_profile(exc=None):
+    # No teardown (chamado mesmo quando a view levanta exceção), para nunca deixar a amostragem ativa.
+    started = g.pop('request_started', None)
+    if slow_request_profiler and started is not None:
+        slow_request_profiler.stop(f"{request.method}-{request_route_label()}", time.perf_counter() - started)
+
+@app.route('/metrics')
+def metrics():
+    """Métricas de todos os workers no formato texto do Prometheus."""
+    return Response(telemetry.render(), mimetype="text/plain; version=0.0.4")
+
+# --- PERSISTÊNCIA EM DISCO (LOCKS, ESCRITA ATÔMICA E WRITE-BEHIND) ---
+class InterProcessLock:
+    """Lock reentrante válido entre threads e entre processos (flock num arquivo em instance/locks)."""
+
+    def __init__(self, name):
+        self.path = os.path.join(LOCKS_FOLDER, hashlib.sha1(name.encode("utf-8")).hexdigest() + '.lock')
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._rlock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._rlock.release()
+
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+def file_lock(name):
+    with _file_locks_guard:
+        lock = _file_locks.get(name)
+        if lock is None:
+            lock = _file_locks[name] = InterProcessLock(name)
+        return lock
+
+def _reset_file_locks():
+    # Locks herdados num fork podem estar presos por threads que não existem no filho.
+    global _file_locks_guard
+    _file_locks_guard = threading.Lock()
+    _file_locks.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_file_locks)
+
+# Quando um lote do write-behind está em andamento, atomic_write só anota os arquivos e o fsync é feito no fim do lote.
+_write_batch = threading.local()
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _fsync_dir(path):
+    # Garante que o rename sobreviva a uma queda de energia; diretórios não podem ser abertos no Windows.
+    if os.name == 'posix':
+        _fsync_path(path)
+
+def atomic_write(path, payload):
+    """Grava bytes num arquivo temporário e o renomeia, para que leitores nunca vejam um arquivo pela metade."""
+    batch = getattr(_write_batch, 'paths', None)
+    durable = app.config['PERSISTENCE_DURABILITY'] != 'none' and batch is None
+    telemetry.inc('portal_bytes_written_total', len(payload), kind=file_kind(path))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if durable:
+        _fsync_dir(os.path.dirname(path))
+    elif batch is not None:
+        batch.add(path)
+
+class WriteBehindQueue:
+    """Fila de gravações em segundo plano.
+
+    Gravações pendentes com a mesma chave são agrupadas (só a última é executada) e cada lote
+    faz um único fsync por arquivo ao final, conforme PERSISTENCE_DURABILITY.
+    """
+
+    def __init__(self):
+        self._pending = OrderedDict()
+        self._in_flight = {}
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def _after_fork(self):
+        # O que estava na fila é gravado pelo processo pai; o filho recomeça com a fila e o lock vazios.
+        self._pending = OrderedDict()
+        self._in_flight = {}
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _ensure_worker(self):
+        # Após um fork (gunicorn --preload), a thread do processo pai não existe no filho.
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def submit(self, key, handler, payload, merge=None):
+        with self._cond:
+            telemetry.inc('portal_write_queue_submitted_total')
+            if key in self._pending:
+                telemetry.inc('portal_write_queue_coalesced_total')
+                if merge is not None:
+                    payload = merge(self._pending[key][1], payload)
+            self._pending[key] = (handler, payload)
+            self._ensure_worker()
+            self._cond.notify_all()
+
+    def pending(self, key):
+        """Payload ainda não gravado para a chave (inclusive o que está sendo gravado agora)."""
+        with self._cond:
+            entry = self._pending.get(key) or self._in_flight.get(key)
+            return entry[1] if entry else None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                self._in_flight = dict(self._pending)
+                self._pending.clear()
+                self._busy = True
+            self._write_batch(self._in_flight)
+            with self._cond:
+                self._in_flight = {}
+                self._busy = False
+                telemetry.inc('portal_write_queue_batches_total')
+                self._cond.notify_all()
+
+    def _write_batch(self, batch):
+        _write_batch.paths = set()
+        try:
+            for key, (handler, payload) in batch.items():
+                try:
+                    handler(payload)
+                except Exception:
+                    app.logger.exception("Falha na gravação em segundo plano de %s", key)
+            written, _write_batch.paths = _write_batch.paths, None
+            if app.config['PERSISTENCE_DURABILITY'] != 'none':
+                for path in written:
+                    # Arquivos gravados e removidos no mesmo lote (ex.: movidos para o armazenamento frio)
+                    if os.path.exists(path):
+                        _fsync_path(path)
+                for folder in {os.path.dirname(path) for path in written}:
+                    _fsync_dir(folder)
+        finally:
+            _write_batch.paths = None
+
+    def flush(self, timeout=None):
+        """Espera até que todas as gravações pendentes tenham sido concluídas."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._busy:
+                if self._thread is None or not self._thread.is_alive():
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+write_queue = WriteBehindQueue()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=write_queue._after_fork)
+# Nada que foi aceito pela fila se perde num encerramento normal do worker.
+atexit.register(write_queue.flush)
+
+# --- REPOSITÓRIO DE USUÁRIOS ---
+class UserStore(ABC):
+    """Interface comum dos backends de usuários (CSV ou SQLite)."""
+
+    COLUMNS = ['username', 'password', 'role', 'status']
+
+    @abstractmethod
+    def get(self, username):
+        raise NotImplementedError
+
+    def exists(self, username):
+        return self.get(username) is not None
+
+    @abstractmethod
+    def records(self, role=None, status=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def add(self, username, password, role='paciente', status='active'):
+        """Insere um usuário novo. Retorna False se o nome de usuário já existir."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_many(self, records):
+        """Insere vários usuários novos num único lote. Retorna os nomes que já existiam (não inseridos)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_status(self, username, status):
+        raise NotImplementedError
+
+    @abstractmethod
+    def query(self, role=None, status=None, search='', match='contains', sort='name', descending=False,
+              after=None, offset=0, limit=50):
+        """Página de usuários filtrada por nome (prefixo ou substring) e ordenada por nome ou criação.
+
+        Com sort='name', `after` faz paginação por cursor (keyset) a partir do último usuário
+        da página anterior; caso contrário usa `offset`. Retorna {'rows', 'total', 'next_after'}.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_summaries(self, summaries):
+        """Grava os resumos de plano ({usuario: resumo}) exibidos no dashboard."""
+        raise NotImplementedError
+
+    def save_summary(self, username, summary):
+        self.save_summaries({username: summary})
+
+    @abstractmethod
+    def summaries(self, usernames=None):
+        """Resumos dos usuários pedidos (ou de todos), como {usuario: resumo}."""
+        raise NotImplementedError
+
+
+class CsvUserStore(UserStore):
+    """Índice em memória do CSV de usuários, recarregado apenas quando o arquivo muda."""
+
+    def __init__(self, path, summary_path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._signature = None
+        self._users = {}
+        self._list_indexes = {}
+        # Resumos dos planos ficam num SQLite à parte, uma linha por paciente.
+        self.summary_path = summary_path
+        self._summary_table = PlanSummaryTable(SqliteConnections(summary_path, PlanSummaryTable.SCHEMA)) if summary_path else None
+
+    def _file_signature(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _refresh(self):
+        # Levanta FileNotFoundError se o CSV não existir. Usa o módulo csv: o pandas só é carregado se for usado.
+        signature = self._file_signature()
+        if signature == self._signature:
+            telemetry.inc('portal_cache_hits_total', cache='users_csv')
+            return
+        telemetry.inc('portal_cache_misses_total', cache='users_csv')
+        telemetry.inc('portal_csv_reads_total')
+        record_read(self.path, signature[1])
+        users = {}
+        with open(self.path, newline='', encoding='utf-8') as f:
+            for record in csv.DictReader(f, restval=''):
+                for column in self.COLUMNS:
+                    record.setdefault(column, '')
+                users[record['username']] = record
+        self._users = users
+        self._list_indexes = {}
+        self._signature = signature
+
+    def _write_lock(self):
+        # Alterações relêem o CSV dentro do lock, para não perder o que outro worker acabou de gravar.
+        return file_lock('users:' + os.path.abspath(self.path))
+
+    def _save(self):
+        # Reescreve o CSV e memoriza a nova assinatura para não recarregar o que já está em memória.
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=self.COLUMNS, extrasaction='ignore', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(self._users.values())
+        telemetry.inc('portal_csv_writes_total')
+        atomic_write(os.path.abspath(self.path), buffer.getvalue().encode("utf-8"))
+        self._list_indexes = {}
+        self._signature = self._file_signature()
+
+    def _list_index(self, role, status):
+        """Listas pré-ordenadas de um filtro (role, status): por nome normalizado e por ordem de criação."""
+        key = (role, status)
+        index = self._list_indexes.get(key)
+        if index is None:
+            created = [u for u, r in self._users.items()
+                       if (role is None or r['role'] == role) and (status is None or r['status'] == status)]
+            index = {'name': sorted((u.casefold(), u) for u in created), 'created': created}
+            self._list_indexes[key] = index
+        return index
+
+    def get(self, username):
+        with self._lock:
+            self._refresh()
+            return self._users.get(username)
+
+    def records(self, role=None, status=None):
+        with self._lock:
+            self._refresh()
+            return [dict(r) for r in self._users.values()
+                    if (role is None or r['role'] == role) and (status is None or r['status'] == status)]
+
+    def add(self, username, password, role='paciente', status='active'):
+        with self._lock, self._write_lock():
+            try:
+                self._refresh()
+            except FileNotFoundError:
+                # Se o arquivo não existe, começa com um repositório vazio
+                self._users = {}
+            if username in self._users:
+                return False
+            self._users[username] = {'username': username, 'password': password, 'role': role, 'status': status}
+            self._save()
+            return True
+
+    def add_many(self, records):
+        with self._lock, self._write_lock():
+            try:
+                self._refresh()
+            except FileNotFoundError:
+                self._users = {}
+            existing = []
+            for record in records:
+                if record['username'] in self._users:
+                    existing.append(record['username'])
+                else:
+                    self._users[record['username']] = {column: record.get(column, '') for column in self.COLUMNS}
+            # Uma única regravação do CSV para o lote inteiro.
+            if len(existing) < len(records):
+                self._save()
+            return existing
+
+    def set_status(self, username, status):
+        with self._lock, self._write_lock():
+            self._refresh()
+            if username in self._users:
+                self._users[username]['status'] = status
+                self._save()
+
+    def query(self, role=None, status=None, search='', match='contains', sort='name', descending=False,
+              after=None, offset=0, limit=50):
+        with self._lock:
+            self._refresh()
+            index = self._list_index(role, status)
+            needle = (search or '').casefold()
+            if sort == 'name':
+                keys = index['name']
+                if needle and match == 'prefix':
+                    # A lista está ordenada pelo nome normalizado: o prefixo é um intervalo contíguo.
+                    keys = keys[bisect_left(keys, (needle,)):bisect_left(keys, (needle + '\U0010ffff',))]
+                elif needle:
+                    keys = [k for k in keys if needle in k[0]]
+                total = len(keys)
+                if after is not None:
+                    cursor = (after.casefold(), after)
+                    if descending:
+                        end = bisect_left(keys, cursor)
+                        page = keys[max(0, end - limit):end][::-1]
+                    else:
+                        start = bisect_right(keys, cursor)
+                        page = keys[start:start + limit]
+                elif descending:
+                    end = total - offset
+                    page = keys[max(0, end - limit):max(0, end)][::-1]
+                else:
+                    page = keys[offset:offset + limit]
+                usernames = [u for _, u in page]
+            else:
+                usernames = index['created']
+                if needle:
+                    test = (lambda u: u.casefold().startswith(needle)) if match == 'prefix' else (lambda u: needle in u.casefold())
+                    usernames = [u for u in usernames if test(u)]
+                total = len(usernames)
+                if descending:
+                    usernames = usernames[::-1]
+                usernames = usernames[offset:offset + limit]
+            rows = [dict(self._users[u]) for u in usernames]
+        next_after = rows[-1]['username'] if sort == 'name' and len(rows) == limit else None
+        return {'rows': rows, 'total': total, 'next_after': next_after}
+
+    def save_summaries(self, summaries):
+        self._summary_table.save(summaries)
+
+    def summaries(self, usernames=None):
+        if self._summary_table is None:
+            return {}
+        return self._summary_table.load(usernames)
+
+    def import_legacy_summaries(self, legacy_path):
+        """Copia os resumos do antigo plan_summaries.json para a tabela e remove o arquivo."""
+        try:
+            with open(legacy_path, encoding="utf-8") as f:
+                summaries = json.load(f)
+        except FileNotFoundError:
+            return 0
+        self.save_summaries(summaries)
+        try:
+            os.remove(legacy_path)
+        except FileNotFoundError:
+            pass  # outro worker migrou ao mesmo tempo
+        return len(summaries)
+
+
+class SqliteConnections:
+    """Conexões SQLite em modo WAL, uma reutilizada por worker/thread."""
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+
+    def get(self):
+        # Após um fork (gunicorn), a conexão herdada do processo pai não pode ser reutilizada.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(self.schema)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class PlanSummaryTable:
+    """Resumos dos planos (dashboard) numa tabela SQLite: cada salvamento grava só a linha do paciente."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS plan_summaries (
+            username TEXT PRIMARY KEY,
+            consultation_date TEXT,
+            latest_month INTEGER,
+            fat REAL,
+            muscle REAL,
+            water REAL,
+            metabolism REAL,
+            goals_completed INTEGER,
+            goals_total INTEGER,
+            plan_size INTEGER,
+            updated_at TEXT
+        );
+    """
+    COLUMNS = ['consultation_date', 'latest_month', 'fat', 'muscle', 'water', 'metabolism',
+               'goals_completed', 'goals_total', 'plan_size', 'updated_at']
+
+    def __init__(self, db):
+        self._db = db
+
+    def save(self, summaries):
+        columns = ['username'] + self.COLUMNS
+        conn = self._db.get()
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany(
+                f"INSERT OR REPLACE INTO plan_summaries ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [[username] + [summary.get(c) for c in self.COLUMNS] for username, summary in summaries.items()])
+
+    def load(self, usernames=None):
+        sql = f"SELECT username, {', '.join(self.COLUMNS)} FROM plan_summaries"
+        params = []
+        if usernames is not None:
+            usernames = list(usernames)
+            if not usernames:
+                return {}
+            sql += f" WHERE username IN ({', '.join('?' * len(usernames))})"
+            params = usernames
+        return {row['username']: {c: row[c] for c in self.COLUMNS}
+                for row in self._db.get().execute(sql, params)}
+
+
+class SqliteUserStore(UserStore):
+    """Usuários em SQLite (modo WAL), com uma conexão reutilizada por worker/thread."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_role_status ON users(role, status);
+        CREATE INDEX IF NOT EXISTS idx_users_role_status_name ON users(role, status, username COLLATE NOCASE);
+    """ + PlanSummaryTable.SCHEMA
+
+    def __init__(self, path):
+        self.path = path
+        self._db = SqliteConnections(path, self.SCHEMA)
+        self._summary_table = PlanSummaryTable(self._db)
+
+    def _connection(self):
+        return self._db.get()
+
+    def get(self, username):
+        row = self._connection().execute(
+            'SELECT username, password, role, status FROM users WHERE username = ?', (username,)).fetchone()
+        return dict(row) if row else None
+
+    @staticmethod
+    def _filters(role, status):
+        clauses, params = [], []
+        if role is not None:
+            clauses.append('role = ?')
+            params.append(role)
+        if status is not None:
+            clauses.append('status = ?')
+            params.append(status)
+        return clauses, params
+
+    def records(self, role=None, status=None):
+        clauses, params = self._filters(role, status)
+        sql = 'SELECT username, password, role, status FROM users'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        return [dict(r) for r in self._connection().execute(sql + ' ORDER BY rowid', params)]
+
+    def query(self, role=None, status=None, search='', match='contains', sort='name', descending=False,
+              after=None, offset=0, limit=50):
+        clauses, params = self._filters(role, status)
+        if search:
+            escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            clauses.append("username LIKE ? ESCAPE '\\'")
+            params.append(escaped + '%' if match == 'prefix' else '%' + escaped + '%')
+        conn = self._connection()
+        where = (' WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        total = conn.execute('SELECT COUNT(*) FROM users' + where, params).fetchone()[0]
+
+        direction = 'DESC' if descending else 'ASC'
+        if sort == 'name':
+            order = f'username COLLATE NOCASE {direction}, username {direction}'
+            if after is not None:
+                op = '<' if descending else '>'
+                clauses.append(f'(username COLLATE NOCASE {op} ? OR (username COLLATE NOCASE = ? AND username {op} ?))')
+                params += [after, after, after]
+                where = ' WHERE ' + ' AND '.join(clauses)
+                offset = 0
+        else:
+            order = f'rowid {direction}'
+        rows = [dict(r) for r in conn.execute(
+            f'SELECT username, password, role, status FROM users{where} ORDER BY {order} LIMIT ? OFFSET ?',
+            params + [limit, offset])]
+        next_after = rows[-1]['username'] if sort == 'name' and len(rows) == limit else None
+        return {'rows': rows, 'total': total, 'next_after': next_after}
+
+    def add(self, username, password, role='paciente', status='active'):
+        try:
+            self._connection().execute('INSERT INTO users (username, password, role, status) VALUES (?, ?, ?, ?)',
+                                       (username, password, role, status))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def add_many(self, records):
+        conn = self._connection()
+        existing = []
+        with conn:
+            conn.execute('BEGIN')
+            for r in records:
+                cursor = conn.execute('INSERT OR IGNORE INTO users (username, password, role, status) VALUES (?, ?, ?, ?)',
+                                      (r['username'], r['password'], r['role'], r['status']))
+                if cursor.rowcount == 0:
+                    existing.append(r['username'])
+        return existing
+
+    def set_status(self, username, status):
+        self._connection().execute('UPDATE users SET status = ? WHERE username = ?', (status, username))
+
+    def import_records(self, records):
+        """Insere/atualiza vários usuários numa única transação."""
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany(
+                'INSERT OR REPLACE INTO users (username, password, role, status) VALUES (?, ?, ?, ?)',
+                [(r['username'], r['password'], r['role'], r['status']) for r in records])
+
+    def save_summaries(self, summaries):
+        self._summary_table.save(summaries)
+
+    def summaries(self, usernames=None):
+        return self._summary_table.load(usernames)
+
+
+def create_user_store(backend):
+    if backend == 'sqlite':
+        return SqliteUserStore(USER_SQLITE_PATH)
+    if backend == 'csv':
+        store = CsvUserStore(USER_DB_PATH, PLAN_SUMMARY_PATH)
+        # Instalações anteriores guardavam os resumos num único JSON.
+        store.import_legacy_summaries(LEGACY_PLAN_SUMMARY_PATH)
+        return store
+    raise ValueError(f"Backend de armazenamento desconhecido: {backend}")
+
+user_store = create_user_store(app.config['STORAGE_BACKEND'])
+
+@app.cli.command('migrate-users')
+@click.option('--csv', 'csv_path', default=USER_DB_PATH, show_default=True, help='CSV de origem.')
+@click.option('--db', 'db_path', default=USER_SQLITE_PATH, show_default=True, help='Banco SQLite de destino.')
+def migrate_users_command(csv_path, db_path):
+    """Migra os usuários do patients.csv para o backend SQLite."""
+    csv_store = CsvUserStore(csv_path, PLAN_SUMMARY_PATH)
+    records = csv_store.records()
+    sqlite_store = SqliteUserStore(db_path)
+    sqlite_store.import_records(records)
+    sqlite_store.save_summaries(csv_store.summaries())
+    click.echo(f"{len(records)} usuários migrados de {csv_path} para {db_path}.")
+
 @login_manager.user_loader
 def load_user(user_id):
     try:
-        users_df = pd.read_csv(USER_DB_PATH)
-        user_data = users_df[users_df['username'] == user_id].iloc[0]
-        return User(id=user_data['username'], password=user_data['password'], role=user_data['role'])
-    except (FileNotFoundError, IndexError):
+        user_data = user_store.get(user_id)
+    except FileNotFoundError:
         return None
+    if user_data is None:
+        return None
+    return User(id=user_data['username'], password=user_data['password'], role=user_data['role'])
 
 def nutritionist_required(f):
     @wraps(f)
@@ -46,231 +1101,1110 @@ def nutritionist_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# --- ARMAZENAMENTO DOS PLANOS ---
+# Cada plano é salvo como JSON canônico (<usuario>.json) ao lado da página renderizada (<usuario>.html).
+PLAN_DATA_MARKER = '<script id="patient-data" type="application/json">'
+# O nome do usuário vira nome de arquivo: nada de separadores, NUL/controles ou nomes começando com ponto.
+UNSAFE_USERNAME_PATTERN = r'^\.|[/\\\x00-\x1f\x7f]'
+
+def is_safe_username(username):
+    return re.search(UNSAFE_USERNAME_PATTERN, username) is None
+
+def plan_html_path(username):
+    return os.path.join(PATIENT_DATA_FOLDER, f"{username}.html")
+
+def plan_json_path(username):
+    return os.path.join(PATIENT_DATA_FOLDER, f"{username}.json")
+
+def encode_plan_data(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode("utf-8")
+
+def write_plan_data(username, data):
+    atomic_write(plan_json_path(username), encode_plan_data(data))
+
+def extract_legacy_plan_data(html_path):
+    """Extrai o JSON embutido em páginas antigas que não têm o arquivo .json ao lado."""
+    with open(html_path, "r", encoding="utf-8") as f:
+        html = f.read()
+    record_read(html_path, len(html))
+    start = html.find(PLAN_DATA_MARKER)
+    if start != -1:
+        end = html.find("</script>", start)
+        if end != -1:
+            telemetry.inc('portal_html_parses_total', parser='marker')
+            return json.loads(html[start + len(PLAN_DATA_MARKER):end])
+    # Páginas editadas à mão podem ter o script em outro formato; só aqui o BeautifulSoup é necessário.
+    telemetry.inc('portal_html_parses_total', parser='bs4')
+    from bs4 import BeautifulSoup
+    data_script = BeautifulSoup(html, "html.parser").find("script", {"id": "patient-data"})
+    return json.loads(data_script.string) if data_script else None
+
+def read_stored_plan(username):
+    """Conteúdo atual do JSON do plano em disco, sem considerar a fila do write-behind."""
+    try:
+        with open(plan_json_path(username), "rb") as f:
+            payload = f.read()
+    except FileNotFoundError:
+        payload = read_cold_member(username, os.path.basename(plan_json_path(username)))
+        return json.loads(payload) if payload else {}
+    record_read(plan_json_path(username), len(payload))
+    return json.loads(payload)
+
+def load_plan_data(username, backfill=True):
+    """Carrega os dados do plano, migrando sob demanda planos que só existem em HTML."""
+    ensure_hot_plan(username)
+    if os.path.exists(plan_json_path(username)) or has_cold_plan(username):
+        # JSON em PATIENT_DATA_FOLDER ou, de paciente arquivado, lido do pacote sem extraí-lo.
+        return read_stored_plan(username)
+    html_path = plan_html_path(username)
+    if os.path.exists(html_path):
+        data = extract_legacy_plan_data(html_path)
+        if data is not None:
+            if backfill:
+                write_plan_data(username, data)
+            return data
+    return {}
+
+# Variantes pré-comprimidas geradas no salvamento, em ordem de preferência.
+PLAN_PAGE_ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+_file_digests = {}
+
+def compress_variant(encoding, payload):
+    if encoding == 'br':
+        return brotli.compress(payload, quality=11) if brotli else None
+    return gzip.compress(payload, compresslevel=9, mtime=0)
+
+def write_plan_page(username, html):
+    """Grava a página do paciente e suas variantes comprimidas (gzip e, se disponível, brotli)."""
+    html_path = plan_html_path(username)
+    payload = html.encode("utf-8")
+    # As variantes vêm antes do .html, que define a ETag: uma ETag nova nunca é servida com um corpo antigo.
+    for encoding, suffix in PLAN_PAGE_ENCODINGS:
+        compressed = compress_variant(encoding, payload)
+        if compressed is None:
+            # Remove variantes antigas que ficariam desatualizadas
+            if os.path.exists(html_path + suffix):
+                os.remove(html_path + suffix)
+            continue
+        atomic_write(html_path + suffix, compressed)
+    atomic_write(html_path, payload)
+
+def file_digest(path):
+    """Hash do conteúdo de um arquivo, memorizado enquanto o arquivo não mudar."""
+    st = os.stat(path)
+    # O inode muda a cada atomic_write, mesmo quando mtime e tamanho coincidem.
+    signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _file_digests.get(path)
+    if cached and cached[0] == signature:
+        telemetry.inc('portal_cache_hits_total', cache='file_digest')
+        return cached[1]
+    telemetry.inc('portal_cache_misses_total', cache='file_digest')
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:32]
+    _file_digests[path] = (signature, digest)
+    return digest
+
+def choose_plan_encoding(available):
+    for candidate, _ in PLAN_PAGE_ENCODINGS:
+        if candidate in available and request.accept_encodings[candidate]:
+            return candidate
+    return None
+
+def plan_page_response(digest, encoding, load_body):
+    """Monta a resposta da página com ETag forte por codificação e 304 para GETs condicionais."""
+    # Cada codificação tem sua própria ETag, já que os bytes entregues são diferentes.
+    etag = digest if encoding is None else f"{digest}-{encoding}"
+
+    if request.if_none_match.contains_weak(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(load_body())
+        response.content_type = "text/html; charset=utf-8"
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def send_plan_page(html_path):
+    """Entrega a página gravada em disco na melhor variante pré-comprimida aceita pelo cliente."""
+    available = {encoding for encoding, suffix in PLAN_PAGE_ENCODINGS if os.path.exists(html_path + suffix)}
+    encoding = choose_plan_encoding(available)
+    path = html_path + dict(PLAN_PAGE_ENCODINGS)[encoding] if encoding else html_path
+
+    def load_body():
+        with open(path, "rb") as f:
+            body = f.read()
+        record_read(path, len(body))
+        return body
+    return plan_page_response(file_digest(html_path), encoding, load_body)
+
+# --- ARMAZENAMENTO FRIO (PACIENTES ARQUIVADOS) ---
+# Ao arquivar, os arquivos do plano vão para <usuario>.zip em COLD_STORAGE_FOLDER. O diretório central
+# do zip serve de índice: cada arquivo é lido direto do pacote, sem extrair os demais.
+COLD_READ_CHUNK = 64 * 1024
+
+def cold_bundle_path(username):
+    return os.path.join(COLD_STORAGE_FOLDER, f"{username}.zip")
+
+def has_cold_plan(username):
+    return os.path.exists(cold_bundle_path(username))
+
+def hot_plan_files(username):
+    """Arquivos do plano em PATIENT_DATA_FOLDER (JSON, página e variantes comprimidas) que existem."""
+    html_path = plan_html_path(username)
+    paths = [plan_json_path(username), html_path] + [html_path + suffix for _, suffix in PLAN_PAGE_ENCODINGS]
+    return [path for path in paths if os.path.exists(path)]
+
+def cold_member_info(username, filename):
+    """ZipInfo de um arquivo do pacote do paciente, ou None."""
+    try:
+        with zipfile.ZipFile(cold_bundle_path(username)) as bundle:
+            return bundle.getinfo(filename)
+    except (FileNotFoundError, KeyError):
+        return None
+
+def read_cold_member(username, filename):
+    """Conteúdo de um arquivo do pacote (descomprimido em fluxo), ou None."""
+    try:
+        with zipfile.ZipFile(cold_bundle_path(username)) as bundle, bundle.open(filename) as f:
+            payload = f.read()
+    except (FileNotFoundError, KeyError):
+        return None
+    record_read(cold_bundle_path(username), len(payload))
+    return payload
+
+def stream_cold_member(username, filename):
+    """Gera o conteúdo de um arquivo do pacote em blocos, para respostas sem carregar tudo na memória."""
+    with zipfile.ZipFile(cold_bundle_path(username)) as bundle, bundle.open(filename) as f:
+        while True:
+            chunk = f.read(COLD_READ_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+
+def cold_member_digest(info):
+    return f"{info.CRC:08x}{info.file_size:x}"
+
+def freeze_plan(username):
+    """Move os arquivos do plano para o pacote comprimido do paciente. Retorna quantos arquivos foram movidos."""
+    if write_queue.pending(('plan', username)) is not None:
+        write_queue.flush()
+    return _freeze_plan_files(username)
+
+def _freeze_plan_files(username):
+    # Chamado também pela própria fila do write-behind, que não pode esperar por si mesma.
+    with plan_lock(username):
+        load_plan_data(username)  # planos antigos só em HTML ganham o JSON antes de ir para o pacote
+        paths = hot_plan_files(username)
+        if not paths:
+            return 0
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as bundle:
+            for path in paths:
+                name = os.path.basename(path)
+                # As variantes .gz/.br já estão comprimidas e entram sem nova compressão.
+                compression = zipfile.ZIP_STORED if name.endswith(('.gz', '.br')) else zipfile.ZIP_DEFLATED
+                bundle.write(path, name, compress_type=compression, compresslevel=9 if compression else None)
+        atomic_write(cold_bundle_path(username), buffer.getvalue())
+        for path in paths:
+            os.remove(path)
+        return len(paths)
+
+def thaw_plan(username):
+    """Traz os arquivos do pacote de volta para PATIENT_DATA_FOLDER e remove o pacote."""
+    with plan_lock(username):
+        bundle_path = cold_bundle_path(username)
+        if not os.path.exists(bundle_path):
+            return 0
+        with zipfile.ZipFile(bundle_path) as bundle:
+            names = bundle.namelist()
+            for name in names:
+                atomic_write(os.path.join(PATIENT_DATA_FOLDER, name), bundle.read(name))
+        os.remove(bundle_path)
+        return len(names)
+
+def ensure_hot_plan(username):
+    """Restauração preguiçosa: o plano de um paciente reativado sai do pacote no primeiro acesso."""
+    if not has_cold_plan(username) or os.path.exists(plan_json_path(username)):
+        return
+    user = user_store.get(username)
+    if user and user['status'] != 'archived':
+        thaw_plan(username)
+
+def send_cold_plan_page(username):
+    """Entrega a página de um paciente arquivado direto do pacote, na melhor variante aceita."""
+    html_name = os.path.basename(plan_html_path(username))
+    info = cold_member_info(username, html_name)
+    if info is None:
+        # Pacote sem página gravada (planos salvos no modo 'dynamic'): renderiza a partir do JSON.
+        return send_rendered_plan(username)
+    available = {encoding for encoding, suffix in PLAN_PAGE_ENCODINGS
+                 if cold_member_info(username, html_name + suffix) is not None}
+    encoding = choose_plan_encoding(available)
+    member = html_name + dict(PLAN_PAGE_ENCODINGS)[encoding] if encoding else html_name
+    return plan_page_response(cold_member_digest(info), encoding, lambda: stream_cold_member(username, member))
+
+# --- ARQUIVOS ESTÁTICOS VERSIONADOS ---
+# CSS, JS e ícones compartilhados pelas páginas dos pacientes são servidos uma única vez,
+# em URLs que mudam com o conteúdo e podem ficar em cache indefinidamente.
+def asset_digest(filename):
+    return file_digest(os.path.join(app.static_folder, filename))[:12]
+
+def asset_url(filename):
+    return url_for('plan_asset', digest=asset_digest(filename), filename=filename)
+
+@app.route('/assets/<digest>/<path:filename>')
+def plan_asset(digest, filename):
+    path = safe_join(app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    current_digest = file_digest(path)[:12]
+    response = send_from_directory(app.static_folder, filename)
+    if digest == current_digest:
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        # Páginas antigas ainda apontam para versões anteriores: entrega o conteúdo atual sem cache longo.
+        response.headers["Cache-Control"] = "public, no-cache"
+    return response
+
 # --- TEMPLATE HTML ---
-HTML_TEMPLATE_CLIENTE = """
-<!DOCTYPE html>
-<html lang="pt-BR">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Guia de Consulta Nutricional - {name}</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet">
-    <style>
-        body {{ font-family: 'Inter', sans-serif; }}
-        .gradient-bg {{ background: linear-gradient(135deg, #1e3a8a, #3b82f6); }}
-        ul li {{ margin-bottom: 0.5rem; }}
-        .chart-filter-btn.active {{ background-color: #3b82f6; color: white; }}
-    </style>
-    <script id="patient-data" type="application/json">
-        {json_data}
-    </script>
-</head>
-<body class="bg-gray-900 text-gray-200">
-    <div class="container mx-auto p-4 sm:p-8">
-        <header class="text-center mb-12 p-8 bg-gray-800 border border-gray-700 text-white rounded-2xl shadow-lg">
-            <h1 class="text-4xl md:text-5xl font-bold mb-2 text-blue-400">Guia de Consulta Nutricional</h1>
-            <p class="text-2xl font-light">{name} - {details}</p>
-            <p class="text-sm mt-2 text-gray-400">Data da Consulta: {consultation_date}</p>
-        </header>
-        <main class="space-y-12">
-            <section id="analise">
-                <h2 class="text-3xl font-bold mb-6 border-l-4 border-blue-500 pl-4">1. Análise Avançada</h2>
-                <div class="grid md:grid-cols-1 lg:grid-cols-3 gap-8">
-                    <div class="bg-gray-800 p-6 rounded-2xl shadow-md border border-gray-700 flex flex-col">
-                        <h3 class="text-xl font-semibold mb-4 text-blue-400">✅ Análise de Bioimpedância</h3>
-                        <ul class="space-y-2 text-gray-300 mb-4">
-                            <li><strong>Percentual de Gordura:</strong> <span class="font-bold text-blue-400">{fat_percentage}%</span></li>
-                            <li><strong>Massa Muscular:</strong> <span class="font-bold text-blue-400">{muscle_mass} kg</span></li>
-                            <li><strong>Água Corporal Total:</strong> <span class="font-bold text-blue-400">{water_percentage}%</span></li>
-                            <li><strong>Taxa Metabólica Basal:</strong> <span class="font-bold text-blue-400">{basal_metabolism} kcal</span></li>
-                        </ul>
-                        {bio_download_button_html}
-                    </div>
-                    <div class="bg-gray-800 p-6 rounded-2xl shadow-md border border-gray-700">
-                        <h3 class="text-xl font-semibold mb-4 text-blue-400">✅ Análise de Hábitos e Rotina</h3>
-                        <ul class="space-y-3 text-gray-300">
-                            <li><strong>Plano Alimentar:</strong><p class="font-light mt-1">{food_plan_text}</p>
-                                {plan_download_button_html}
-                            </li>
-                            <li><strong>Identificação de Erros:</strong> {errors}</li>
-                            <li><strong>Ponto de Melhoria:</strong> {improvements}</li>
-                        </ul>
-                    </div>
-                    <div class="bg-gray-800 p-6 rounded-2xl shadow-md border border-gray-700">
-                        <h3 class="text-xl font-semibold mb-4 text-blue-400">✅ Análise de Sinais Corporais</h3>
-                        <ul class="space-y-2 list-disc list-inside text-gray-300">{signals_html}</ul>
-                    </div>
-                </div>
-            </section>
-            
-            <section id="plano-nutricional">
-                <h2 class="text-3xl font-bold mb-6 border-l-4 border-blue-500 pl-4">2. Plano Nutricional</h2>
-                <div class="grid md:grid-cols-1 lg:grid-cols-3 gap-8">
-                    <div class="bg-gray-800 p-6 rounded-2xl shadow-md border border-gray-700">
-                        <h3 class="text-xl font-semibold mb-4 text-blue-400">✅ Cardápio 100% Adaptável</h3>
-                        <p class="text-gray-400 mb-2">Exemplo de Substituição:</p>
-                        <p class="text-gray-300">{substitutions_example}</p>
-                    </div>
-                    <div class="bg-gray-800 p-6 rounded-2xl shadow-md border border-gray-700">
-                        <h3 class="text-xl font-semibold mb-4 text-blue-400">✅ Plano de Suplementação</h3>
-                        <ul class="space-y-2 text-gray-300 list-disc list-inside">{supplements_html}</ul>
-                    </div>
-                    <div class="bg-gray-800 p-6 rounded-2xl shadow-md border border-gray-700">
-                        <h3 class="text-xl font-semibold mb-4 text-blue-400">✅ Guia de Compras</h3>
-                        <h4 class="font-semibold text-blue-300">Priorizar:</h4>
-                        <p class="text-gray-300 mb-2">{shopping_prioritize}</p>
-                        <h4 class="font-semibold text-blue-300">Evitar:</h4>
-                        <p class="text-gray-300">{shopping_avoid}</p>
-                    </div>
-                </div>
-            </section>
-
-            <section id="acompanhamento">
-                <h2 class="text-3xl font-bold mb-6 border-l-4 border-blue-500 pl-4">3. Acompanhamento e Suporte</h2>
-                <div class="bg-gray-800 p-8 rounded-2xl shadow-lg grid md:grid-cols-3 gap-8 text-center border border-gray-700">
-                    <div>
-                        <h3 class="text-xl font-semibold mb-2 text-blue-400">Ajustes em Tempo Real</h3>
-                        <p class="text-gray-400">Mande a foto do seu prato e receba feedback em até 12 horas. Adaptação da dieta para viagens e torneios.</p>
-                    </div>
-                    <div>
-                        <h3 class="text-xl font-semibold mb-2 text-blue-400">Monitoramento de Sintomas</h3>
-                        <p class="text-gray-400 mb-3">Sentiu inchaço? Reduza o sódio e aumente a ingestão de chás diuréticos. Fale comigo para ajustes.</p>
-                        <a href="https://wa.me/5521969489421" target="_blank" class="inline-flex items-center gap-2 text-sm bg-green-500 text-white font-semibold py-2 px-4 rounded-lg hover:bg-green-600 transition-colors">Relatar Sintoma no WhatsApp</a>
-                    </div>
-                    <div>
-                        <h3 class="text-xl font-semibold mb-2 text-blue-400">Suporte por WhatsApp</h3>
-                        <p class="text-gray-400">"Posso trocar o frango por peixe?" Respostas rápidas para suas dúvidas do dia a dia.</p>
-                    </div>
-                </div>
-            </section>
-
-            <section id="bonus">
-                <h2 class="text-3xl font-bold mb-6 border-l-4 border-blue-500 pl-4">4. Bônus Exclusivos</h2>
-                <div class="grid md:grid-cols-3 gap-8">
-                    <div class="bg-gray-800 p-6 rounded-2xl text-center shadow-md border border-blue-800 flex flex-col">
-                        <h3 class="text-xl font-semibold mb-2 text-blue-400">🎁 E-book de Receitas</h3>
-                        <p class="text-blue-300 mb-3">Receitas rápidas e focadas em energia.</p>
-                        <a href="https://ambrosioo.github.io/ebook_receitas/" target="_blank" class="mt-auto inline-flex items-center justify-center gap-2 text-sm gradient-bg text-white font-semibold py-2 px-4 rounded-lg">Baixar E-book</a>
-                    </div>
-                    <div class="bg-gray-800 p-6 rounded-2xl text-center shadow-md border border-blue-800 flex flex-col">
-                        <h3 class="text-xl font-semibold mb-2 text-blue-400">🥪 Guia do Fim de Semana</h3>
-                        <p class="text-blue-300 mb-3">Lanches inteligentes para não sair do foco.</p>
-                        <a href="https://ambrosioo.github.io/guia_fim_de_semana/" target="_blank" class="mt-auto inline-flex items-center justify-center gap-2 text-sm gradient-bg text-white font-semibold py-2 px-4 rounded-lg">Baixar Guia</a>
-                    </div>
-                    <div class="bg-gray-800 p-6 rounded-2xl shadow-md border border-blue-800 flex flex-col">
-                        <h3 class="text-xl font-semibold mb-4 text-blue-400">✅ Check-list de Progresso</h3>
-                        <ul class="space-y-3 text-left text-gray-300">{goals_html}</ul>
-                    </div>
-                </div>
-            </section>
-            
-            <section id="resultados">
-                <h2 class="text-3xl font-bold mb-6 border-l-4 border-blue-500 pl-4">5. Relatórios e Resultados</h2>
-                <div class="grid md:grid-cols-1 lg:grid-cols-2 gap-8">
-                    <div class="bg-gray-800 p-6 rounded-2xl shadow-lg border border-gray-700">
-                        <h3 class="text-xl font-semibold mb-4 text-blue-400">📊 Relatório Mensal de Evolução</h3>
-                        <div id="chart-container" class="w-full">
-                            <div class="flex justify-center gap-2 mb-4 flex-wrap">
-                                <button data-metric="fat" class="chart-filter-btn px-3 py-1 bg-gray-700 rounded-md text-sm">Gordura (%)</button>
-                                <button data-metric="muscle" class="chart-filter-btn px-3 py-1 bg-gray-700 rounded-md text-sm">Músculo (kg)</button>
-                                <button data-metric="water" class="chart-filter-btn px-3 py-1 bg-gray-700 rounded-md text-sm">Água (%)</button>
-                                <button data-metric="metabolism" class="chart-filter-btn px-3 py-1 bg-gray-700 rounded-md text-sm">Metabolismo (kcal)</button>
-                            </div>
-                            <canvas id="evolutionChart"></canvas>
-                        </div>
-                    </div>
-                    <div class="bg-gray-800 p-6 rounded-2xl shadow-lg flex flex-col justify-center items-center text-center border border-gray-700">
-                        <h3 class="text-xl font-semibold mb-4 text-blue-400">🎯 Previsão de Resultados</h3>
-                        <p class="text-gray-300 text-lg">{prediction_text}</p>
-                    </div>
-                </div>
-            </section>
-        </main>
-        <footer class="text-center mt-16 py-6 border-t border-gray-700">
-            <p class="text-gray-500">Este é o início da sua jornada para a máxima performance.</p>
-            <p class="text-gray-400 font-semibold">Vamos juntos, {name_first}!</p>
-            <div class="mt-4">
-                <p class="font-bold text-gray-200">Caio Araújo</p>
-                <p class="text-sm text-gray-500">Nutricionista | CRN 24103010</p>
-            </div>
-        </footer>
-    </div>
-    <script>
-        document.addEventListener('DOMContentLoaded', () => {{
-            const dataScript = document.getElementById('patient-data');
-            if (!dataScript) return;
-
-            const patientData = JSON.parse(dataScript.textContent);
-            const evolutionData = patientData.evolution;
-
-            if (!evolutionData || evolutionData.length === 0) {{
-                document.getElementById('chart-container').innerHTML = '<p class="text-center text-gray-400">Nenhum dado de evolução mensal registrado.</p>';
-                return;
-            }}
-
-            const labels = evolutionData.map(d => 'Mês ' + d.month);
-            const metrics = {{
-                fat: {{ label: 'Gordura (%)', data: evolutionData.map(d => parseFloat(d.fat) || 0) }},
-                muscle: {{ label: 'Músculo (kg)', data: evolutionData.map(d => parseFloat(d.muscle) || 0) }},
-                water: {{ label: 'Água (%)', data: evolutionData.map(d => parseFloat(d.water) || 0) }},
-                metabolism: {{ label: 'Metabolismo (kcal)', data: evolutionData.map(d => parseFloat(d.metabolism) || 0) }}
-            }};
-
-            const ctx = document.getElementById('evolutionChart').getContext('2d');
-            const evolutionChart = new Chart(ctx, {{
-                type: 'line',
-                data: {{
-                    labels: labels,
-                    datasets: [{{
-                        label: 'Selecione um indicador',
-                        data: [],
-                        borderColor: '#3b82f6',
-                        backgroundColor: 'rgba(59, 130, 246, 0.2)',
-                        fill: true,
-                        tension: 0.1
-                    }}]
-                }},
-                options: {{
-                    responsive: true,
-                    scales: {{
-                        y: {{ beginAtZero: true, ticks: {{ color: '#cbd5e1' }}, grid: {{ color: 'rgba(255, 255, 255, 0.1)' }} }},
-                        x: {{ ticks: {{ color: '#cbd5e1' }}, grid: {{ color: 'rgba(255, 255, 255, 0.1)' }} }}
-                    }},
-                    plugins: {{ legend: {{ labels: {{ color: '#cbd5e1' }} }} }}
-                }}
-            }});
-
-            const buttons = document.querySelectorAll('.chart-filter-btn');
-            
-            function updateChart(metricKey) {{
-                const metric = metrics[metricKey];
-                evolutionChart.data.datasets[0].label = metric.label;
-                evolutionChart.data.datasets[0].data = metric.data;
-                evolutionChart.update();
-                
-                buttons.forEach(btn => {{
-                    btn.classList.toggle('active', btn.dataset.metric === metricKey);
-                }});
-            }}
-
-            buttons.forEach(button => {{
-                button.addEventListener('click', () => {{
-                    updateChart(button.dataset.metric);
-                }});
-            }});
-
-            if(buttons.length > 0) {{
-                updateChart(buttons[0].dataset.metric);
-            }}
-        }});
-    </script>
-</body>
-</html>
-"""
+# A página do paciente é gerada a partir de templates/plan_cliente.html.
+PLAN_TEMPLATE = 'plan_cliente.html'
+
+def plan_template_context(data):
+    return {
+        "json_data": Markup(json.dumps(data, ensure_ascii=False).replace("<", "\\u003c")), "name": data.get("name"), "details": data.get("details"),
+        "consultation_date": data.get("consultation_date"),
+        "fat_percentage": data.get("bioimpedance", {}).get("fat_percentage", "N/A"), "muscle_mass": data.get("bioimpedance", {}).get("muscle_mass", "N/A"),
+        "water_percentage": data.get("bioimpedance", {}).get("water_percentage", "N/A"), "basal_metabolism": data.get("bioimpedance", {}).get("basal_metabolism", "N/A"),
+        "bio_url": data.get("bioimpedance", {}).get("url"), "food_plan_text": data.get("habits", {}).get("food_plan_text", ""),
+        "plan_url": data.get("habits", {}).get("url"), "errors": data.get("habits", {}).get("errors", ""), "improvements": data.get("habits", {}).get("improvements", ""),
+        "signals": data.get("signals", []), "substitutions_example": data.get("plan", {}).get("substitutions_example", ""), "supplements": data.get("plan", {}).get("supplements", []),
+        "shopping_prioritize": data.get("plan", {}).get("shopping_prioritize", ""), "shopping_avoid": data.get("plan", {}).get("shopping_avoid", ""),
+        "prediction_text": data.get("results", {}).get("prediction_text", ""), "goals": data.get("goals", []),
+        "name_first": data["name"].split(' ')[0] if data.get("name") else "",
+        "plan_css_url": asset_url("plan.css"), "plan_js_url": asset_url("plan.js"), "icons_url": asset_url("icons.svg"),
+        "evolution_url": url_for('evolution_api')
+    }
+
+_plan_template = {}
+
+def plan_template():
+    """Template compilado da página do paciente, recarregado quando o arquivo muda.
+
+    Fora do modo debug o Jinja não confere os arquivos (auto_reload=False); sem isto, uma página nova
+    sairia com a versão nova no cache e na ETag mas com o markup antigo.
+    """
+    digest = file_digest(plan_template_path())
+    cached = _plan_template.get('entry')
+    if cached is None or cached[0] != digest:
+        cached = _plan_template['entry'] = (digest, app.jinja_env.loader.load(app.jinja_env, PLAN_TEMPLATE))
+    return cached[1]
+
+def plan_template_path():
+    return os.path.join(app.root_path, app.template_folder, PLAN_TEMPLATE)
+
+def render_plan_html(data):
+    started = time.perf_counter()
+    html = render_template(plan_template(), **plan_template_context(data))
+    telemetry.observe('portal_render_duration_seconds', time.perf_counter() - started)
+    return html
+
+def plan_template_version():
+    """Muda sempre que o template ou um dos arquivos estáticos referenciados pela página muda."""
+    parts = [file_digest(plan_template_path())] + [asset_digest(name) for name in ("plan.css", "plan.js", "icons.svg")]
+    return hashlib.sha256("".join(parts).encode()).hexdigest()[:16]
+
+class PlanRenderCache:
+    """Cache LRU das páginas renderizadas, por (usuário, versão dos dados, versão do template)."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                telemetry.inc('portal_cache_misses_total', cache='plan_render')
+                return None
+            self._entries.move_to_end(key)
+            telemetry.inc('portal_cache_hits_total', cache='plan_render')
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == username]:
+                del self._entries[key]
+
+plan_render_cache = PlanRenderCache(app.config['PLAN_RENDER_CACHE_SIZE'])
+
+def send_rendered_plan(username):
+    """Renderiza a página a partir do JSON (modo 'dynamic'), reaproveitando o cache LRU."""
+    load_plan_data(username)  # garante o JSON para planos antigos que só existem em HTML
+    json_path = plan_json_path(username)
+    st = os.stat(json_path if os.path.exists(json_path) else cold_bundle_path(username))
+    key = (username, (st.st_mtime_ns, st.st_size), plan_template_version())
+    entry = plan_render_cache.get(key)
+    if entry is None:
+        payload = render_plan_html(load_plan_data(username)).encode("utf-8")
+        entry = {None: payload, "digest": hashlib.sha256(payload).hexdigest()[:32]}
+        for encoding, _ in PLAN_PAGE_ENCODINGS:
+            compressed = compress_variant(encoding, payload)
+            if compressed is not None:
+                entry[encoding] = compressed
+        plan_render_cache.put(key, entry)
+    encoding = choose_plan_encoding(entry)
+    return plan_page_response(entry["digest"], encoding, lambda: entry[encoding])
+
+# --- PERSISTÊNCIA DOS PLANOS ---
+def parse_measurement(value):
+    """Converte um valor digitado no formulário ("20,5", "20.5") em float; None se vazio ou inválido."""
+    if value is None or value == '':
+        return None
+    try:
+        return float(str(value).replace(',', '.'))
+    except ValueError:
+        return None
+
+def default_plan_data(username):
+    """Campos de um plano novo, como o formulário de edição os preenche (nome do usuário, data de hoje)."""
+    return {
+        "name": username.replace('%20', ' '), "details": "", "consultation_date": datetime.now().strftime('%d/%m/%Y'),
+        "bioimpedance": {}, "habits": {}, "signals": [], "plan": {}, "results": {},
+        "goals": [{"text": "", "completed": False} for _ in range(3)]
+    }
+
+def build_plan_summary(data, plan_size):
+    """Resumo compacto do plano exibido no dashboard, sem precisar abrir o arquivo do paciente."""
+    evolution = sorted(data.get('evolution', []), key=lambda item: item.get('month', 0))
+    latest = evolution[-1] if evolution else {}
+    goals = data.get('goals', [])
+    return {
+        'consultation_date': data.get('consultation_date'),
+        'latest_month': latest.get('month'),
+        'fat': parse_measurement(latest.get('fat')), 'muscle': parse_measurement(latest.get('muscle')),
+        'water': parse_measurement(latest.get('water')), 'metabolism': parse_measurement(latest.get('metabolism')),
+        'goals_completed': sum(1 for g in goals if g.get('completed')), 'goals_total': len(goals),
+        'plan_size': plan_size, 'updated_at': datetime.now().isoformat(timespec='seconds'),
+    }
+
+class PlanVersionConflict(Exception):
+    """O plano foi alterado por outra pessoa desde a versão que o cliente leu."""
+
+    def __init__(self, current_version):
+        super().__init__(f"O plano foi alterado por outra pessoa (versão atual: {current_version}).")
+        self.current_version = current_version
+
+def plan_lock(username):
+    return file_lock('plan:' + username)
+
+def persist_plan(username, data, expected_version=None, changed=None):
+    """Grava o plano e atualiza tudo o que deriva dele (página, cache de renderização, resumo e métricas).
+
+    Incrementa data['version']; com `expected_version`, recusa a gravação (PlanVersionConflict) se o
+    plano salvo já estiver em outra versão. `changed` lista as chaves alteradas, para pular derivados
+    que não dependem delas. Retorna a nova versão.
+    """
+    with plan_lock(username):
+        current_version = load_plan_data(username).get('version', 0)
+        if expected_version is not None and expected_version != current_version:
+            raise PlanVersionConflict(current_version)
+        data['version'] = current_version + 1
+        if app.config['PERSISTENCE_MODE'] == 'write-behind':
+            # O JSON (com a nova versão) é gravado já, sob o lock, para que outros processos vejam a versão;
+            # só a página e os derivados vão para a fila, agrupando salvamentos repetidos.
+            write_plan_json(username, data, encode_plan_data(data))
+            write_queue.submit(('plan', username), _write_queued_plan,
+                               {'username': username, 'version': data['version'], 'changed': changed,
+                                'base_url': request.url_root if has_request_context() else None},
+                               merge=_merge_queued_plans)
+        else:
+            write_plan_artifacts(username, data, changed)
+    return data['version']
+
+# Durante um lote (importação), resumos, métricas e índice de busca são acumulados e gravados uma vez no fim.
+_derived_batch = threading.local()
+
+@contextmanager
+def batched_plan_derivatives():
+    batch = _derived_batch.pending = {'summaries': {}, 'evolutions': {}, 'search': {}}
+    try:
+        yield
+    finally:
+        _derived_batch.pending = None
+        if batch['summaries']:
+            user_store.save_summaries(batch['summaries'])
+        if batch['evolutions']:
+            metrics_store.update_many(batch['evolutions'])
+        if batch['search']:
+            search_index.update_many(batch['search'])
+
+def write_plan_artifacts(username, data, changed=None):
+    """Grava o JSON do plano e tudo o que deriva dele, sob o lock do paciente."""
+    with plan_lock(username):
+        payload = encode_plan_data(data)
+        # Renderiza antes de gravar qualquer coisa: um plano que não vira página não chega ao disco.
+        html = render_plan_html(data) if app.config['PLAN_RENDER_MODE'] != 'dynamic' else None
+        write_plan_json(username, data, payload)
+        write_plan_derivatives(username, data, payload, changed, html)
+
+def write_plan_json(username, data, payload):
+    """Registra a versão no histórico e grava o JSON do plano; o chamador detém o lock do paciente."""
+    previous = read_stored_plan(username)
+    # Planos de pacientes arquivados são regravados fora do pacote e voltam para ele depois dos derivados.
+    thaw_plan(username)
+    plan_history.append(username, previous, data)
+    atomic_write(plan_json_path(username), payload)
+
+def write_plan_derivatives(username, data, payload, changed=None, html=None):
+    """Página (ou cache de renderização), resumo, métricas e índice de busca de um JSON já gravado."""
+    with plan_lock(username):
+        if html is None and app.config['PLAN_RENDER_MODE'] != 'dynamic':
+            html = render_plan_html(data)
+        thaw_plan(username)
+        if html is None:
+            # A página será renderizada no próximo acesso; só descarta o que estava em cache.
+            plan_render_cache.invalidate(username)
+        else:
+            write_plan_page(username, html)
+        summary = build_plan_summary(data, len(payload))
+        batch = getattr(_derived_batch, 'pending', None)
+        if batch is not None:
+            batch['summaries'][username] = summary
+            if changed is None or 'evolution' in changed:
+                batch['evolutions'][username] = data.get('evolution', [])
+            batch['search'][username] = (plan_search_fields(data), patient_status(username))
+        else:
+            user_store.save_summary(username, summary)
+            if changed is None or 'evolution' in changed:
+                metrics_store.update(username, data.get('evolution', []))
+            search_index.update(username, data, patient_status(username))
+        # Paciente arquivado: o plano vai para o pacote, mesmo que ainda não houvesse um (ex.: primeiro plano).
+        if patient_status(username) == 'archived':
+            _freeze_plan_files(username)
+
+def _merge_queued_plans(previous, latest):
+    # Só a última versão é derivada, mas os derivados precisam cobrir as chaves alteradas por todas.
+    if previous['changed'] is None or latest['changed'] is None:
+        changed = None
+    else:
+        changed = previous['changed'] | latest['changed']
+    return dict(latest, changed=changed)
+
+def _write_queued_plan(task):
+    # Fora da requisição, a página é renderizada num contexto com a mesma URL base (para o url_for).
+    username = task['username']
+    with app.test_request_context(base_url=task['base_url']), plan_lock(username):
+        data = load_plan_data(username)
+        if data.get('version') != task['version']:
+            # Outro salvamento (deste ou de outro processo) já gravou uma versão mais nova e enfileirou seus derivados.
+            return
+        write_plan_derivatives(username, data, encode_plan_data(data), task['changed'])
+
+# --- HISTÓRICO DE VERSÕES DOS PLANOS ---
+def diff_plan(old, new, path=()):
+    """Diferença entre duas versões do plano como lista de {'path': [...], 'value'} ou {'path': [...], 'delete': True}."""
+    ops = []
+    for key in old:
+        if key not in new:
+            ops.append({'path': list(path + (key,)), 'delete': True})
+    for key, value in new.items():
+        if key in old and isinstance(value, dict) and isinstance(old[key], dict):
+            ops.extend(diff_plan(old[key], value, path + (key,)))
+        elif key not in old or old[key] != value:
+            ops.append({'path': list(path + (key,)), 'value': value})
+    return ops
+
+def apply_plan_delta(data, ops):
+    for op in ops:
+        container = data
+        for key in op['path'][:-1]:
+            container = container.setdefault(key, {})
+        if op.get('delete'):
+            container.pop(op['path'][-1], None)
+        else:
+            container[op['path'][-1]] = copy.deepcopy(op['value'])
+    return data
+
+class PlanHistory:
+    """Histórico append-only por paciente: deltas JSON comprimidos, com um snapshot completo a cada N versões.
+
+    <usuario>.log guarda um registro por linha; <usuario>.idx guarda versão, data, posição e tipo de cada
+    registro, para que a reconstrução leia no máximo SNAPSHOT_INTERVAL registros.
+    """
+
+    SNAPSHOT_INTERVAL = 10
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def _paths(self, username):
+        base = os.path.join(self.folder, username)
+        return base + '.log', base + '.idx'
+
+    def index(self, username):
+        _, idx_path = self._paths(username)
+        try:
+            with open(idx_path, encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _append_record(self, username, entries, version, saved_at, kind, payload):
+        log_path, idx_path = self._paths(username)
+        line = json.dumps({'v': version, 'ts': saved_at, 'kind': kind,
+                           'z': base64.b64encode(zlib.compress(encode_plan_data(payload), 9)).decode("ascii")}) + '\n'
+        with open(log_path, 'ab') as log:
+            offset = log.tell()
+            log.write(line.encode("ascii"))
+            if app.config['PERSISTENCE_DURABILITY'] != 'none':
+                log.flush()
+                os.fsync(log.fileno())
+        entry = {'v': version, 'ts': saved_at, 'kind': kind, 'offset': offset, 'length': len(line)}
+        with open(idx_path, 'a', encoding="utf-8") as idx:
+            idx.write(json.dumps(entry) + '\n')
+        entries.append(entry)
+
+    def append(self, username, previous, data):
+        """Registra `data` como nova versão (chamado com o lock do paciente, antes de sobrescrever o JSON)."""
+        os.makedirs(self.folder, exist_ok=True)
+        entries = self.index(username)
+        saved_at = datetime.now().isoformat(timespec='seconds')
+        if not entries and previous:
+            # Primeiro salvamento com histórico: preserva a versão que já existia como snapshot inicial.
+            self._append_record(username, entries, previous.get('version', 0), saved_at, 'full', previous)
+        last_full = max((i for i, e in enumerate(entries) if e['kind'] == 'full'), default=None)
+        if last_full is None or len(entries) - last_full >= self.SNAPSHOT_INTERVAL or not previous:
+            self._append_record(username, entries, data.get('version', 0), saved_at, 'full', data)
+        else:
+            self._append_record(username, entries, data.get('version', 0), saved_at, 'delta', diff_plan(previous, data))
+
+    def _read_payload(self, log, entry):
+        log.seek(entry['offset'])
+        record = json.loads(log.read(entry['length']))
+        return json.loads(zlib.decompress(base64.b64decode(record['z'])))
+
+    def versions(self, username):
+        return [{'version': e['v'], 'saved_at': e['ts'], 'kind': e['kind']} for e in self.index(username)]
+
+    def get(self, username, version):
+        """Reconstrói a versão pedida a partir do último snapshot anterior a ela; None se não existir."""
+        entries = self.index(username)
+        target = next((i for i in range(len(entries) - 1, -1, -1) if entries[i]['v'] == version), None)
+        if target is None:
+            return None
+        start = max(i for i in range(target + 1) if entries[i]['kind'] == 'full')
+        log_path, _ = self._paths(username)
+        with open(log_path, 'rb') as log:
+            data = self._read_payload(log, entries[start])
+            for entry in entries[start + 1:target + 1]:
+                apply_plan_delta(data, self._read_payload(log, entry))
+        return data
+
+    def version_as_of(self, username, moment):
+        """Última versão salva até `moment` (datetime; com fuso, é convertido para o horário local dos registros)."""
+        if moment.tzinfo is not None:
+            moment = moment.astimezone().replace(tzinfo=None)
+        # Mesmo formato dos registros ('AAAA-MM-DDTHH:MM:SS'), para que a comparação de textos siga a ordem das datas.
+        moment = moment.isoformat(timespec='seconds')
+        candidates = [e['v'] for e in self.index(username) if e['ts'] <= moment]
+        return candidates[-1] if candidates else None
+
+plan_history = PlanHistory(PLAN_HISTORY_FOLDER)
+
+def describe_plan_diff(old, new):
+    """Diferença legível entre duas versões, com caminhos no formato 'habits.errors'."""
+    changes = []
+    for op in diff_plan(old, new):
+        path = '.'.join(str(p) for p in op['path'])
+        if path == 'version':
+            continue
+        if op.get('delete'):
+            changes.append({'path': path, 'from': _nested_get(old, op['path']), 'to': None})
+        else:
+            changes.append({'path': path, 'from': _nested_get(old, op['path']), 'to': op['value']})
+    return changes
+
+def _nested_get(data, path):
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+# --- BUSCA TEXTUAL NOS PLANOS ---
+# Palavras muito comuns em português que não ajudam a encontrar planos.
+SEARCH_STOPWORDS = frozenset('a o e de da do das dos em no na nos nas um uma com para por que ao aos as os se sem ou'.split())
+
+def fold_text(text):
+    """Minúsculas e sem acentos: 'Insônia' e 'insonia' viram o mesmo termo."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+def tokenize(text):
+    return [t for t in re.findall(r'[a-z0-9]+', fold_text(text)) if len(t) > 1 and t not in SEARCH_STOPWORDS]
+
+def plan_search_fields(data):
+    """Textos do plano indexados, por campo."""
+    habits, plan = data.get('habits', {}), data.get('plan', {})
+    return {
+        'signals': ' '.join(s for s in data.get('signals', []) if s),
+        'supplements': ' '.join(s for s in plan.get('supplements', []) if s),
+        'errors': habits.get('errors') or '',
+        'improvements': habits.get('improvements') or '',
+        'substitutions': plan.get('substitutions_example') or '',
+        'shopping': ' '.join(filter(None, [plan.get('shopping_prioritize'), plan.get('shopping_avoid')])),
+        'goals': ' '.join(g.get('text') or '' for g in data.get('goals', [])),
+    }
+
+class PlanSearchIndex:
+    """Índice invertido (termo -> paciente, campo) em SQLite, atualizado a cada salvamento ou arquivamento."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS search_postings (
+            term TEXT NOT NULL,
+            field TEXT NOT NULL,
+            username TEXT NOT NULL,
+            PRIMARY KEY (term, field, username)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_search_postings_username ON search_postings(username);
+        CREATE TABLE IF NOT EXISTS search_docs (
+            username TEXT PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT ''
+        );
+    """
+    FIELDS = ('signals', 'supplements', 'errors', 'improvements', 'substitutions', 'shopping', 'goals')
+
+    def __init__(self, path):
+        self._db = SqliteConnections(path, self.SCHEMA)
+
+    def update_many(self, documents):
+        """Reindexa os pacientes informados ({usuario: (textos por campo, status)}) numa única transação."""
+        conn = self._db.get()
+        with conn:
+            conn.execute('BEGIN')
+            for username, (fields, status) in documents.items():
+                conn.execute('DELETE FROM search_postings WHERE username = ?', (username,))
+                postings = {(term, field, username)
+                            for field, text in fields.items() for term in tokenize(text)}
+                conn.executemany('INSERT INTO search_postings (term, field, username) VALUES (?, ?, ?)', postings)
+                conn.execute('INSERT OR REPLACE INTO search_docs (username, status) VALUES (?, ?)', (username, status))
+
+    def update(self, username, data, status):
+        self.update_many({username: (plan_search_fields(data), status)})
+
+    def set_status(self, username, status):
+        self._db.get().execute('UPDATE search_docs SET status = ? WHERE username = ?', (status, username))
+
+    def search(self, query, field=None, status='active', limit=50):
+        """Pacientes cujo plano contém todos os termos (o último também como prefixo), com os campos encontrados."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        conditions, params = [], []
+        for position, term in enumerate(terms):
+            if position == len(terms) - 1:
+                conditions.append('term >= ? AND term < ?')
+                params.append([term, term + '\uffff'])
+            else:
+                conditions.append('term = ?')
+                params.append([term])
+        field_filter = ' AND field = ?' if field else ''
+        field_params = [field] if field else []
+        matches = ' INTERSECT '.join(f'SELECT username FROM search_postings WHERE {c}{field_filter}' for c in conditions)
+        sql = f"""
+            SELECT p.username, group_concat(DISTINCT p.field) AS fields
+            FROM search_postings p JOIN search_docs d ON d.username = p.username
+            WHERE p.username IN ({matches})
+              AND ({' OR '.join(f'({c})' for c in conditions)}){field_filter.replace('field', 'p.field')}
+        """
+        args = [v for term_params in params for v in term_params + field_params]
+        args += [v for term_params in params for v in term_params] + field_params
+        if status != 'all':
+            sql += ' AND d.status = ?'
+            args.append(status)
+        sql += ' GROUP BY p.username ORDER BY p.username LIMIT ?'
+        args.append(limit)
+        return [{'username': row['username'], 'fields': sorted(row['fields'].split(','))}
+                for row in self._db.get().execute(sql, args)]
+
+search_index = PlanSearchIndex(SEARCH_INDEX_PATH)
+
+def patient_status(username):
+    user = user_store.get(username)
+    return user['status'] if user else ''
+
+# --- ATUALIZAÇÕES PARCIAIS (PATCH) ---
+PLAN_FIELDS = ('name', 'details', 'consultation_date', 'bioimpedance', 'habits', 'signals', 'plan', 'results', 'goals', 'evolution')
+EVOLUTION_FIELDS = ('fat', 'muscle', 'water', 'metabolism')
+PATCH_SEGMENT = re.compile(r'^(\w+)((?:\[[^\]]+\])*)$')
+PATCH_SELECTOR = re.compile(r'\[([^\]]+)\]')
+
+def parse_patch_path(path):
+    """Converte 'goals[1].completed' ou 'evolution[month=7]' numa lista de passos (chave, índice ou seletor)."""
+    steps = []
+    for segment in path.split('.'):
+        match = PATCH_SEGMENT.match(segment)
+        if not match:
+            raise ValueError(f"Caminho inválido: {path}")
+        steps.append(('key', match.group(1)))
+        for selector in PATCH_SELECTOR.findall(match.group(2)):
+            if '=' in selector:
+                field, value = selector.split('=', 1)
+                steps.append(('match', field, int(value) if value.isdigit() else value))
+            elif selector.isdigit():
+                steps.append(('index', int(selector)))
+            else:
+                raise ValueError(f"Seletor inválido em {path}: [{selector}]")
+    if steps[0][1] not in PLAN_FIELDS:
+        raise ValueError(f"Campo desconhecido: {steps[0][1]}")
+    return steps
+
+def apply_plan_patch(data, path, value):
+    """Aplica uma alteração ao dicionário do plano.
+
+    Num seletor como evolution[month=7], um dicionário é mesclado ao item (criado se não existir)
+    e None remove o item.
+    """
+    steps = parse_patch_path(path)
+    container = data
+    for position, step in enumerate(steps):
+        last = position == len(steps) - 1
+        if step[0] == 'key':
+            if last:
+                container[step[1]] = value
+                return
+            default = [] if steps[position + 1][0] != 'key' else {}
+            if not isinstance(container.get(step[1]), type(default)):
+                container[step[1]] = default
+            container = container[step[1]]
+        elif step[0] == 'index':
+            if step[1] >= len(container):
+                raise ValueError(f"Índice fora do intervalo em {path}")
+            if last:
+                container[step[1]] = value
+                return
+            container = container[step[1]]
+        else:
+            _, field, wanted = step
+            item = next((i for i in container if isinstance(i, dict) and i.get(field) == wanted), None)
+            if last:
+                if value is None:
+                    if item is not None:
+                        container.remove(item)
+                    return
+                if not isinstance(value, dict):
+                    raise ValueError(f"{path} espera um objeto")
+                if item is None:
+                    item = {field: wanted}
+                    container.append(item)
+                item.update(value)
+                if all(k == field for k in item):
+                    raise ValueError(f"{path} não pode ficar vazio")
+                return
+            if item is None:
+                raise ValueError(f"Item não encontrado em {path}")
+            container = item
+
+PLAN_TEXT_FIELDS = ('name', 'details', 'consultation_date')
+PLAN_SECTION_FIELDS = {
+    'bioimpedance': ('fat_percentage', 'muscle_mass', 'water_percentage', 'basal_metabolism', 'url'),
+    'habits': ('food_plan_text', 'errors', 'improvements', 'url'),
+    'plan': ('substitutions_example', 'shopping_prioritize', 'shopping_avoid'),
+    'results': ('prediction_text',),
+}
+
+def _is_text(value):
+    return value is None or isinstance(value, str)
+
+def _is_measure(value):
+    # Medidas chegam como no formulário ("20,5", "", None) ou como números.
+    if value is None or value == '':
+        return True
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float)):
+        return True
+    return isinstance(value, str) and parse_measurement(value) is not None
+
+def validate_plan_shape(data, previous=None, fields=None):
+    """Confere os tipos dos campos `fields` do plano (todos, por padrão); levanta ValueError antes que algo
+    inválido seja gravado.
+
+    Com `previous` (o plano salvo), valores de goals e evolution que não mudaram não são conferidos: o
+    formulário grava as medidas como texto livre, e um valor antigo não deve bloquear a alteração de outro campo.
+    """
+    fields = PLAN_FIELDS if fields is None else fields
+    previous = previous or {}
+    for field in PLAN_TEXT_FIELDS:
+        if field in fields and not _is_text(data.get(field)):
+            raise ValueError(f"{field} deve ser texto")
+    for section, section_fields in PLAN_SECTION_FIELDS.items():
+        if section not in fields:
+            continue
+        value = data.get(section, {})
+        if not isinstance(value, dict):
+            raise ValueError(f"{section} deve ser um objeto")
+        for field in section_fields:
+            if not _is_text(value.get(field)):
+                raise ValueError(f"{section}.{field} deve ser texto")
+    if 'plan' in fields:
+        supplements = data.get('plan', {}).get('supplements', [])
+        if not isinstance(supplements, list) or not all(_is_text(s) for s in supplements):
+            raise ValueError("plan.supplements deve ser uma lista de textos")
+    if 'signals' in fields:
+        signals = data.get('signals', [])
+        if not isinstance(signals, list) or not all(_is_text(s) for s in signals):
+            raise ValueError("signals deve ser uma lista de textos")
+    if 'goals' in fields:
+        goals = data.get('goals', [])
+        if not isinstance(goals, list):
+            raise ValueError("goals deve ser uma lista")
+        old_goals = previous.get('goals') if isinstance(previous.get('goals'), list) else []
+        for index, goal in enumerate(goals):
+            if index < len(old_goals) and goal == old_goals[index]:
+                continue
+            if not isinstance(goal, dict) or not _is_text(goal.get('text')) \
+                    or not isinstance(goal.get('completed', False), bool):
+                raise ValueError(f"goals[{index}] deve ter text (texto) e completed (booleano)")
+    if 'evolution' in fields:
+        evolution = data.get('evolution', [])
+        if not isinstance(evolution, list):
+            raise ValueError("evolution deve ser uma lista")
+        old_entries = {entry.get('month'): entry for entry in previous.get('evolution', []) if isinstance(entry, dict)} \
+            if isinstance(previous.get('evolution'), list) else {}
+        for entry in evolution:
+            if not isinstance(entry, dict):
+                raise ValueError("Cada item de evolution deve ser um objeto")
+            month = entry.get('month')
+            if isinstance(month, bool) or not isinstance(month, int) or not 1 <= month <= 12:
+                raise ValueError("evolution[].month deve ser um inteiro de 1 a 12")
+            old_entry = old_entries.get(month, {})
+            for field in EVOLUTION_FIELDS:
+                if field in old_entry and entry.get(field) == old_entry[field]:
+                    continue
+                if not _is_measure(entry.get(field)):
+                    raise ValueError(f"evolution[month={month}].{field} deve ser numérico ou vazio")
+
+def patch_plan(username, operations, expected_version):
+    """Aplica uma lista de {'path', 'value'} ao plano salvo e grava uma nova versão."""
+    with plan_lock(username):
+        previous = load_plan_data(username)
+        data = copy.deepcopy(previous)
+        if expected_version != data.get('version', 0):
+            raise PlanVersionConflict(data.get('version', 0))
+        changed = set()
+        for operation in operations:
+            apply_plan_patch(data, operation['path'], operation.get('value'))
+            changed.add(parse_patch_path(operation['path'])[0][1])
+        # Só o que a operação alterou é conferido.
+        validate_plan_shape(data, previous, changed)
+        if 'evolution' in changed:
+            data['evolution'].sort(key=lambda item: item.get('month', 0))
+        return persist_plan(username, data, expected_version=expected_version, changed=changed), data
+
+# --- MÉTRICAS DE EVOLUÇÃO (ARMAZENAMENTO COLUNAR) ---
+class EvolutionMetricsStore:
+    """Medidas mensais de todos os pacientes numa matriz float64 (paciente x métrica x mês) mapeada em memória.
+
+    A matriz fica em values.npy (NaN para meses sem medida) e o mapa usuario -> linha em rows.json.
+    """
+
+    METRICS = ('fat', 'muscle', 'water', 'metabolism')
+    MONTHS = 12
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.values_path = os.path.join(folder, 'values.npy')
+        self.rows_path = os.path.join(folder, 'rows.json')
+        self._lock = threading.RLock()
+        self._signature = None
+        self._rows = {}
+        self._values = None
+
+    def _current_signature(self):
+        try:
+            rows_st, values_st = os.stat(self.rows_path), os.stat(self.values_path)
+        except FileNotFoundError:
+            return None
+        # A matriz é alterada no próprio mmap; só a troca do arquivo (crescimento) muda o inode.
+        return (rows_st.st_mtime_ns, rows_st.st_size, values_st.st_ino, values_st.st_size)
+
+    def _refresh(self):
+        signature = self._current_signature()
+        if signature == self._signature:
+            return
+        if signature is None:
+            self._rows, self._values = {}, None
+        else:
+            with open(self.rows_path, encoding="utf-8") as f:
+                self._rows = json.load(f)
+            self._values = np.load(self.values_path, mmap_mode='r+')
+        self._signature = signature
+
+    def _ensure_capacity(self, needed):
+        capacity = 0 if self._values is None else self._values.shape[0]
+        if needed <= capacity:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = self.values_path + '.tmp'
+        grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float64,
+                                          shape=(max(64, capacity * 2, needed), len(self.METRICS), self.MONTHS))
+        grown[:] = np.nan
+        if capacity:
+            grown[:capacity] = self._values
+        grown.flush()
+        del grown
+        os.replace(tmp_path, self.values_path)
+        self._values = np.load(self.values_path, mmap_mode='r+')
+
+    def update_many(self, evolutions):
+        """Substitui as medidas dos pacientes informados ({usuario: lista 'evolution' do plano})."""
+        with self._lock, file_lock('metrics:' + self.folder):
+            self._refresh()
+            new_rows = [u for u in evolutions if u not in self._rows]
+            for username in new_rows:
+                self._rows[username] = len(self._rows)
+            self._ensure_capacity(len(self._rows))
+            for username, evolution in evolutions.items():
+                row = self._values[self._rows[username]]
+                row[:] = np.nan
+                for item in evolution:
+                    month = item.get('month')
+                    if isinstance(month, int) and 1 <= month <= self.MONTHS:
+                        for m, metric in enumerate(self.METRICS):
+                            value = parse_measurement(item.get(metric))
+                            if value is not None:
+                                row[m, month - 1] = value
+            self._values.flush()
+            if new_rows:
+                atomic_write(self.rows_path, json.dumps(self._rows, ensure_ascii=False).encode("utf-8"))
+            self._signature = self._current_signature()
+
+    def update(self, username, evolution):
+        self.update_many({username: evolution})
+
+    def matrix(self, usernames=None):
+        """Retorna (usuarios, cópia da matriz) para os usuários pedidos, ou para todos."""
+        with self._lock:
+            self._refresh()
+            if usernames is None:
+                names = list(self._rows)
+            else:
+                names = [u for u in usernames if u in self._rows]
+            if self._values is None or not names:
+                return names, np.full((0, len(self.METRICS), self.MONTHS), np.nan)
+            return names, np.array(self._values[[self._rows[u] for u in names]])
+
+metrics_store = EvolutionMetricsStore(METRICS_FOLDER)
+
+def _nan_to_none(array):
+    return [[None if np.isnan(v) else round(float(v), 3) for v in row] for row in np.atleast_2d(array)]
+
+def evolution_analytics(names, values, wrong_way_limit=50):
+    """Estatísticas da clínica por métrica e mês: médias, percentis, variações e quem está piorando."""
+    import warnings
+    result = {'patients': len(names), 'metrics': {}}
+    latest_deltas = {}
+    months = np.arange(EvolutionMetricsStore.MONTHS)
+    with warnings.catch_warnings():
+        # Meses sem nenhuma medida geram avisos de "mean of empty slice"; o resultado é NaN, que vira null.
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        for m, metric in enumerate(EvolutionMetricsStore.METRICS):
+            series = values[:, m, :]
+            mean = np.nanmean(series, axis=0) if len(names) else np.full(len(months), np.nan)
+            pcts = np.nanpercentile(series, [25, 50, 75], axis=0) if len(names) else np.full((3, len(months)), np.nan)
+
+            # Última e penúltima medida de cada paciente, sem laços em Python.
+            valid = ~np.isnan(series)
+            positions = np.where(valid, months, -1)
+            last = positions.max(axis=1)
+            previous = np.where(positions == last[:, None], -1, positions).max(axis=1)
+            has_delta = (last >= 0) & (previous >= 0)
+            rows = np.arange(len(names))
+            delta = np.full(len(names), np.nan)
+            delta[has_delta] = series[rows[has_delta], last[has_delta]] - series[rows[has_delta], previous[has_delta]]
+
+            result['metrics'][metric] = {
+                'mean': _nan_to_none(mean)[0],
+                'p25': _nan_to_none(pcts[0])[0], 'p50': _nan_to_none(pcts[1])[0], 'p75': _nan_to_none(pcts[2])[0],
+                'count': valid.sum(axis=0).tolist(),
+                'month_over_month_mean_delta': _nan_to_none(np.diff(mean))[0],
+                'latest_delta_mean': None if not has_delta.any() else round(float(np.nanmean(delta)), 3),
+            }
+            latest_deltas[metric] = delta
+
+    # Piorando: gordura subindo ou massa muscular caindo entre as duas últimas medidas.
+    fat_delta, muscle_delta = latest_deltas['fat'], latest_deltas['muscle']
+    wrong_way = np.flatnonzero((fat_delta > 0) | (muscle_delta < 0))
+    severity = np.nan_to_num(fat_delta[wrong_way]) - np.nan_to_num(muscle_delta[wrong_way])
+    ordered = wrong_way[np.argsort(-severity)][:wrong_way_limit]
+    result['trending_wrong_way'] = {
+        'total': int(len(wrong_way)),
+        'patients': [{'username': names[i],
+                      'fat_delta': None if np.isnan(fat_delta[i]) else round(float(fat_delta[i]), 3),
+                      'muscle_delta': None if np.isnan(muscle_delta[i]) else round(float(muscle_delta[i]), 3)}
+                     for i in ordered],
+    }
+    return result
+
+def clinic_evolution_analytics(status='active'):
+    usernames = None
+    if status != 'all':
+        usernames = [r['username'] for r in user_store.records(role='paciente', status=status)]
+    names, values = metrics_store.matrix(usernames)
+    return evolution_analytics(names, values)
+
+# --- API DE EVOLUÇÃO ---
+EVOLUTION_METRIC_LABELS = {'fat': 'Gordura (%)', 'muscle': 'Músculo (kg)', 'water': 'Água (%)', 'metabolism': 'Metabolismo (kcal)'}
+
+def evolution_series(username, metrics):
+    """Séries numéricas por métrica (meses com alguma medida), lidas do armazenamento colunar."""
+    names, values = metrics_store.matrix([username])
+    if not names:
+        # Planos salvos antes do armazenamento colunar: preenche a linha do paciente uma única vez.
+        metrics_store.update(username, load_plan_data(username).get('evolution', []))
+        names, values = metrics_store.matrix([username])
+    row = values[0]
+    months = np.flatnonzero(~np.isnan(row).all(axis=0))
+    series = {'months': (months + 1).tolist(), 'labels': [f"Mês {m + 1}" for m in months], 'metrics': {}}
+    for metric in metrics:
+        data = row[EvolutionMetricsStore.METRICS.index(metric), months]
+        series['metrics'][metric] = {'label': EVOLUTION_METRIC_LABELS[metric],
+                                     'data': [None if np.isnan(v) else float(v) for v in data]}
+    return series
+
+def evolution_response(username):
+    metrics = [m for m in request.args.get('metric', '').split(',') if m] or list(EvolutionMetricsStore.METRICS)
+    if any(m not in EVOLUTION_METRIC_LABELS for m in metrics):
+        return jsonify(error=f"Métrica inválida. Use: {', '.join(EvolutionMetricsStore.METRICS)}."), 400
+    if not os.path.exists(plan_json_path(username)):
+        # Planos antigos só em HTML ganham o JSON aqui; sem nenhum dos dois, não há plano.
+        if not load_plan_data(username):
+            return jsonify(error="Plano não encontrado."), 404
+
+    # A ETag vem das próprias séries (lidas do armazenamento colunar), não do JSON do plano: durante um
+    # lote as métricas são gravadas depois do JSON, e a ETag nunca pode anunciar dados que o corpo não tem.
+    series = evolution_series(username, metrics)
+    etag = hashlib.sha256(json.dumps(series, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+    if request.if_none_match.contains_weak(etag):
+        response = make_response("", 304)
+    else:
+        response = jsonify(series)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 # --- ROTAS DA APLICAÇÃO ---
 
@@ -305,18 +2239,41 @@ def logout():
     logout_user()
     return redirect(url_for('login'))
 
+PATIENTS_PER_PAGE = 50
+PATIENT_SORTS = ('name', 'created')
+
+def render_patient_list(template, status):
+    """Renderiza uma página da lista de pacientes com busca, ordenação e paginação no servidor."""
+    search = request.args.get('q', '').strip()
+    match = 'prefix' if request.args.get('match') == 'prefix' else 'contains'
+    sort = request.args.get('sort') if request.args.get('sort') in PATIENT_SORTS else 'name'
+    descending = request.args.get('order') == 'desc'
+    per_page = min(max(request.args.get('per_page', PATIENTS_PER_PAGE, type=int), 1), 200)
+    page = max(request.args.get('page', 1, type=int), 1)
+    after = request.args.get('after') or None
+
+    listing = dict(search=search, match=match, sort=sort, order='desc' if descending else 'asc',
+                   per_page=per_page, page=page, total=0, next_after=None)
+    try:
+        result = user_store.query(role='paciente', status=status, search=search, match=match, sort=sort,
+                                  descending=descending, after=after, offset=(page - 1) * per_page, limit=per_page)
+    except FileNotFoundError:
+        flash("Arquivo de pacientes não encontrado.", "error")
+        return render_template(template, patients=[], listing=listing)
+    listing.update(total=result['total'], next_after=result['next_after'],
+                   has_next=page * per_page < result['total'])
+    # Resumos só da página atual: nenhum arquivo de paciente é aberto para montar a lista.
+    summaries = user_store.summaries(r['username'] for r in result['rows'])
+    for patient in result['rows']:
+        patient['summary'] = summaries.get(patient['username'])
+    return render_template(template, patients=result['rows'], listing=listing)
+
 @app.route('/dashboard')
 @login_required
 @nutritionist_required
 def dashboard():
-    try:
-        users_df = pd.read_csv(USER_DB_PATH)
-        # Filtra apenas pacientes que também são 'ativos'
-        active_patients = users_df[(users_df['role'] == 'paciente') & (users_df['status'] == 'active')].to_dict('records')
-        return render_template('dashboard.html', patients=active_patients)
-    except FileNotFoundError:
-        flash("Arquivo de pacientes não encontrado.", "error")
-        return render_template('dashboard.html', patients=[])
+    # Lista apenas pacientes que também são 'ativos'
+    return render_patient_list('dashboard.html', status='active')
     
 @app.route('/create_patient', methods=['GET', 'POST'])
 @login_required
@@ -333,28 +2290,18 @@ def create_patient():
             return redirect(url_for('create_patient'))
 
         try:
-            # Lê o CSV para verificar se o usuário já existe
-            users_df = pd.read_csv(USER_DB_PATH)
-            if username in users_df['username'].values:
+            # Consulta o índice para verificar se o usuário já existe
+            if user_store.exists(username):
                 flash(f"O nome de usuário '{username}' já existe. Por favor, escolha outro.", 'error')
                 return redirect(url_for('create_patient'))
         except FileNotFoundError:
-            # Se o arquivo não existe, cria um DataFrame vazio
-            users_df = pd.DataFrame(columns=['username', 'password', 'role'])
-
-        # Cria um novo DataFrame para o novo paciente
-        new_patient = pd.DataFrame({
-            'username': [username],
-            'password': [password],
-            'role': ['paciente'],
-            'status': ['active']
-        })
-
-        # Adiciona o novo paciente ao DataFrame existente
-        updated_users_df = pd.concat([users_df, new_patient], ignore_index=True)
-        
-        # Salva o DataFrame atualizado de volta no arquivo CSV
-        updated_users_df.to_csv(USER_DB_PATH, index=False)
+            # Se o arquivo não existe, o repositório cria um CSV novo
+            pass
+
+        # Adiciona o novo paciente; a inserção também rejeita nomes criados em paralelo
+        if not user_store.add(username, password, role='paciente', status='active'):
+            flash(f"O nome de usuário '{username}' já existe. Por favor, escolha outro.", 'error')
+            return redirect(url_for('create_patient'))
 
         flash(f"Paciente '{username}' criado com sucesso!", 'success')
         return redirect(url_for('dashboard'))
@@ -366,22 +2313,17 @@ def create_patient():
 @login_required
 @nutritionist_required
 def archived_patients():
-    try:
-        users_df = pd.read_csv(USER_DB_PATH)
-        # Filtra apenas pacientes que são 'arquivados'
-        archived = users_df[(users_df['role'] == 'paciente') & (users_df['status'] == 'archived')].to_dict('records')
-        return render_template('archived.html', patients=archived)
-    except FileNotFoundError:
-        flash("Arquivo de pacientes não encontrado.", "error")
-        return render_template('archived.html', patients=[])
+    # Lista apenas pacientes que são 'arquivados'
+    return render_patient_list('archived.html', status='archived')
 
 def set_patient_status(username, status):
     """Função auxiliar para mudar o status de um paciente no CSV."""
     try:
-        users_df = pd.read_csv(USER_DB_PATH)
-        # Encontra o índice do paciente e atualiza o status
-        users_df.loc[users_df['username'] == username, 'status'] = status
-        users_df.to_csv(USER_DB_PATH, index=False)
+        # Atualiza o status de uma única linha no backend configurado
+        user_store.set_status(username, status)
+        search_index.set_status(username, status)
+        if status == 'archived':
+            freeze_plan(username)
         return True
     except FileNotFoundError:
         return False
@@ -413,13 +2355,19 @@ def view_plan():
     if current_user.role == 'nutricionista':
         return redirect(url_for('dashboard'))
         
-    patient_file = f"{current_user.id}.html"
-    patient_file_path = os.path.join(PATIENT_DATA_FOLDER, patient_file)
+    patient_file_path = plan_html_path(current_user.id)
 
-    if os.path.exists(patient_file_path):
-        return send_from_directory(PATIENT_DATA_FOLDER, patient_file)
-    else:
-        return """
+    ensure_hot_plan(current_user.id)
+    if app.config['PLAN_RENDER_MODE'] == 'dynamic':
+        if os.path.exists(plan_json_path(current_user.id)) or os.path.exists(patient_file_path) or has_cold_plan(current_user.id):
+            return send_rendered_plan(current_user.id)
+    elif os.path.exists(patient_file_path):
+        return send_plan_page(patient_file_path)
+    elif has_cold_plan(current_user.id):
+        # Paciente arquivado: a página é lida direto do pacote comprimido.
+        return send_cold_plan_page(current_user.id)
+    # Nos dois modos, sem plano salvo o paciente vê o aviso de espera.
+    return """
         <body style='font-family: sans-serif; background-color: #111827; color: #e5e7eb; display: flex; align-items: center; justify-content: center; height: 100vh; text-align: center;'>
             <div>
                 <h1>Aguardando Plano</h1>
@@ -434,18 +2382,10 @@ def view_plan():
 @nutritionist_required
 def edit_plan(username):
     patient_data = {}
-    patient_file = f"{username}.html"
-    patient_file_path = os.path.join(PATIENT_DATA_FOLDER, patient_file)
-
-    if os.path.exists(patient_file_path):
-        try:
-            with open(patient_file_path, "r", encoding="utf-8") as f:
-                soup = BeautifulSoup(f, "html.parser")
-                data_script = soup.find("script", {"id": "patient-data"})
-                if data_script:
-                    patient_data = json.loads(data_script.string)
-        except Exception as e:
-            flash(f"Erro ao carregar dados existentes: {e}", "error")
+    try:
+        patient_data = load_plan_data(username)
+    except Exception as e:
+        flash(f"Erro ao carregar dados existentes: {e}", "error")
     
     # ### INÍCIO DA CORREÇÃO ###
     # Garante que a estrutura de dados esteja completa antes de enviar para o template.
@@ -469,12 +2409,7 @@ def edit_plan(username):
     patient_data['evolution'] = complete_evolution_list
     
     # Garante que as outras chaves principais também existam para evitar erros.
-    default_keys = {
-        "name": username.replace('%20', ' '), "details": "", "consultation_date": datetime.now().strftime('%d/%m/%Y'),
-        "bioimpedance": {}, "habits": {}, "signals": [], "plan": {}, "results": {},
-        "goals": [{"text": "", "completed": False} for _ in range(3)]
-    }
-    for key, default_value in default_keys.items():
+    for key, default_value in default_plan_data(username).items():
         patient_data.setdefault(key, default_value)
     # ### FIM DA CORREÇÃO ###
 
@@ -505,38 +2440,618 @@ def save_plan(username):
         if fat or muscle or water or metabolism:
              data["evolution"].append({'month': i, 'fat': fat, 'muscle': muscle, 'water': water, 'metabolism': metabolism})
 
-    bio_url = data.get("bioimpedance", {}).get("url")
-    plan_url = data.get("habits", {}).get("url")
-    bio_btn_html = f'<a href="{bio_url}" target="_blank" class="mt-auto inline-flex items-center justify-center gap-2 text-sm gradient-bg text-white font-semibold py-2 px-4 rounded-lg hover:opacity-90 transition-opacity">Baixar Análise Detalhada</a>' if bio_url else ""
-    plan_btn_html = f'<a href="{plan_url}" target="_blank" class="mt-3 inline-flex items-center gap-2 text-sm gradient-bg text-white font-semibold py-2 px-4 rounded-lg hover:opacity-90 transition-opacity">Baixar Plano Alimentar</a>' if plan_url else ""
-    goals_html = "".join([f'<li class="flex items-center {"text-green-400" if g["completed"] else ""}">{get_goal_icon(g["completed"])}<span>{g["text"]}</span></li>' for g in data["goals"] if g['text']])
-    signals_html = "".join([f'<li>{s}</li>' for s in data["signals"] if s])
-    supplements_html = "".join([f'<li>{s}</li>' for s in data.get("plan", {}).get("supplements", []) if s])
+    expected_version = request.form.get('version', type=int)
+    try:
+        persist_plan(username, data, expected_version=expected_version)
+    except PlanVersionConflict as e:
+        flash(f"{e} Recarregue o plano antes de salvar para não sobrescrever as alterações.", "error")
+        return redirect(url_for('edit_plan', username=username))
 
-    format_args = {
-        "json_data": json.dumps(data, indent=4, ensure_ascii=False), "name": data["name"], "details": data["details"], "consultation_date": data["consultation_date"],
-        "fat_percentage": data.get("bioimpedance", {}).get("fat_percentage", "N/A"), "muscle_mass": data.get("bioimpedance", {}).get("muscle_mass", "N/A"),
-        "water_percentage": data.get("bioimpedance", {}).get("water_percentage", "N/A"), "basal_metabolism": data.get("bioimpedance", {}).get("basal_metabolism", "N/A"),
-        "bio_download_button_html": bio_btn_html, "food_plan_text": data.get("habits", {}).get("food_plan_text", ""),
-        "plan_download_button_html": plan_btn_html, "errors": data.get("habits", {}).get("errors", ""), "improvements": data.get("habits", {}).get("improvements", ""),
-        "signals_html": signals_html, "substitutions_example": data.get("plan", {}).get("substitutions_example", ""), "supplements_html": supplements_html,
-        "shopping_prioritize": data.get("plan", {}).get("shopping_prioritize", ""), "shopping_avoid": data.get("plan", {}).get("shopping_avoid", ""),
-        "prediction_text": data.get("results", {}).get("prediction_text", ""), "goals_html": goals_html, "name_first": data["name"].split(' ')[0] if data["name"] else ""
+    flash(f"Plano do paciente '{username}' salvo com sucesso!", "success")
+    return redirect(url_for('dashboard'))
+
+@app.route('/api/evolution')
+@login_required
+def evolution_api():
+    """Séries de evolução do próprio paciente logado (usadas pelo gráfico da página do plano)."""
+    if current_user.role == 'nutricionista':
+        return jsonify(error="Use /api/evolution/<usuario>."), 400
+    return evolution_response(current_user.id)
+
+@app.route('/api/evolution/<username>')
+@login_required
+@nutritionist_required
+def patient_evolution_api(username):
+    return evolution_response(username)
+
+def plan_etag(version):
+    return f"v{version}"
+
+def plan_json_response(data):
+    response = jsonify(data)
+    response.set_etag(plan_etag(data.get('version', 0)))
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+def apply_patch_request(username, operations):
+    """Executa um PATCH com controle de concorrência otimista via If-Match."""
+    if not os.path.exists(plan_json_path(username)) and not load_plan_data(username):
+        return jsonify(error="Plano não encontrado."), 404
+    if not request.if_match:
+        return jsonify(error="Envie o cabeçalho If-Match com a ETag do plano."), 428
+    expected = next((int(tag[1:]) for tag in request.if_match.as_set() if re.fullmatch(r'v\d+', tag)), None)
+    if expected is None:
+        return jsonify(error="If-Match inválido."), 412
+    try:
+        _, data = patch_plan(username, operations, expected)
+    except PlanVersionConflict as e:
+        response = jsonify(error=str(e), version=e.current_version)
+        response.status_code = 412
+        response.set_etag(plan_etag(e.current_version))
+        return response
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify(error=str(e)), 400
+    return plan_json_response(data)
+
+@app.route('/api/plan/<username>', methods=['GET', 'PATCH'])
+@login_required
+@nutritionist_required
+def plan_api(username):
+    """GET devolve o plano com ETag de versão; PATCH aplica {"ops": [{"path": ..., "value": ...}]}."""
+    if request.method == 'GET':
+        data = load_plan_data(username)
+        if not data:
+            return jsonify(error="Plano não encontrado."), 404
+        if request.if_none_match.contains_weak(plan_etag(data.get('version', 0))):
+            response = make_response("", 304)
+            response.set_etag(plan_etag(data.get('version', 0)))
+            return response
+        return plan_json_response(data)
+    body = request.get_json(silent=True) or {}
+    operations = body.get('ops', [body] if 'path' in body else [])
+    if not operations or not all(isinstance(op, dict) and 'path' in op for op in operations):
+        return jsonify(error="Informe 'ops' como uma lista de {path, value}."), 400
+    return apply_patch_request(username, operations)
+
+@app.route('/api/plan/<username>/goals/<int:index>', methods=['PATCH'])
+@login_required
+@nutritionist_required
+def patch_plan_goal(username, index):
+    body = request.get_json(silent=True) or {}
+    operations = [{'path': f'goals[{index}].{field}', 'value': body[field]} for field in ('text', 'completed') if field in body]
+    if not operations:
+        return jsonify(error="Informe 'text' e/ou 'completed'."), 400
+    return apply_patch_request(username, operations)
+
+@app.route('/api/plan/<username>/evolution/<int:month>', methods=['PATCH', 'DELETE'])
+@login_required
+@nutritionist_required
+def patch_plan_evolution_month(username, month):
+    if not 1 <= month <= 12:
+        return jsonify(error="O mês deve estar entre 1 e 12."), 400
+    if request.method == 'DELETE':
+        return apply_patch_request(username, [{'path': f'evolution[month={month}]', 'value': None}])
+    body = request.get_json(silent=True) or {}
+    values = {field: body[field] for field in EVOLUTION_FIELDS if field in body}
+    if not values:
+        return jsonify(error=f"Informe ao menos um de: {', '.join(EVOLUTION_FIELDS)}."), 400
+    return apply_patch_request(username, [{'path': f'evolution[month={month}]', 'value': values}])
+
+@app.route('/api/plan/<username>/history')
+@login_required
+@nutritionist_required
+def plan_history_list(username):
+    return jsonify(username=username, versions=plan_history.versions(username))
+
+@app.route('/api/plan/<username>/history/<int:version>')
+@login_required
+@nutritionist_required
+def plan_history_version(username, version):
+    # A versão mais recente vem direto do JSON atual, sem reconstruir deltas.
+    current = load_plan_data(username)
+    data = current if current and current.get('version', 0) == version else plan_history.get(username, version)
+    if data is None:
+        return jsonify(error="Versão não encontrada."), 404
+    return jsonify(data)
+
+@app.route('/api/plan/<username>/history/as-of')
+@login_required
+@nutritionist_required
+def plan_history_as_of(username):
+    moment = request.args.get('date', '')
+    try:
+        parsed = datetime.fromisoformat(moment)
+    except ValueError:
+        return jsonify(error="Informe date no formato AAAA-MM-DD ou AAAA-MM-DDTHH:MM:SS."), 400
+    if re.fullmatch(r'\d{4}-?\d{2}-?\d{2}', moment):
+        # Só a data: inclui o dia inteiro.
+        parsed = parsed.replace(hour=23, minute=59, second=59)
+    version = plan_history.version_as_of(username, parsed)
+    if version is None:
+        return jsonify(error="Nenhuma versão salva até essa data."), 404
+    return plan_history_version(username, version)
+
+@app.route('/api/plan/<username>/history/diff')
+@login_required
+@nutritionist_required
+def plan_history_diff(username):
+    from_version = request.args.get('from', type=int)
+    to_version = request.args.get('to', type=int)
+    if from_version is None or to_version is None:
+        return jsonify(error="Informe os parâmetros from e to."), 400
+    old, new = plan_history.get(username, from_version), plan_history.get(username, to_version)
+    if old is None or new is None:
+        return jsonify(error="Versão não encontrada."), 404
+    return jsonify({'from': from_version, 'to': to_version, 'changes': describe_plan_diff(old, new)})
+
+@app.route('/analytics/evolution')
+@login_required
+@nutritionist_required
+def evolution_analytics_view():
+    status = request.args.get('status', 'active')
+    if status not in ('active', 'archived', 'all'):
+        abort(400)
+    return jsonify(clinic_evolution_analytics(status))
+
+@app.route('/api/search')
+@login_required
+@nutritionist_required
+def search_plans():
+    """Busca nos textos dos planos: todos os termos precisam aparecer, sem diferenciar acentos."""
+    status = request.args.get('status', 'active')
+    field = request.args.get('field') or None
+    if status not in ('active', 'archived', 'all') or (field and field not in PlanSearchIndex.FIELDS):
+        abort(400)
+    results = search_index.search(request.args.get('q', ''), field=field, status=status)
+    return jsonify(results=results)
+
+# --- IMPORTAÇÃO EM LOTE ---
+# Pacientes (username, password[, status]) e medidas de evolução (username, month, fat, muscle, water,
+# metabolism) em CSV ou NDJSON. A validação é feita de uma vez sobre o DataFrame; as linhas inválidas
+# entram no relatório e as demais são gravadas em lotes.
+IMPORT_BATCH_SIZE = 500
+IMPORT_COLUMNS = {
+    'patients': (('username', 'password'), ('status',)),
+    'evolution': (('username', 'month'), EVOLUTION_FIELDS),
+}
+
+def read_import_frame(stream, import_format, kind):
+    """Lê o arquivo como DataFrame de textos, com as colunas esperadas para o tipo de importação."""
+    if import_format == 'ndjson':
+        frame = pd.read_json(stream, lines=True, dtype=False)
+        frame = frame.astype(object).where(frame.notna(), '').astype(str)
+    else:
+        frame = pd.read_csv(stream, dtype=str, keep_default_na=False)
+    required, optional = IMPORT_COLUMNS[kind]
+    missing = [column for column in required if column not in frame.columns]
+    if missing:
+        raise ValueError(f"Colunas obrigatórias ausentes: {', '.join(missing)}.")
+    for column in optional:
+        if column not in frame.columns:
+            frame[column] = ''
+    frame = frame[list(required + optional)].apply(lambda column: column.str.strip())
+    frame.index = pd.RangeIndex(1, len(frame) + 1)  # número da linha de dados no relatório
+    return frame
+
+def import_errors(frame, checks):
+    """Primeiro erro de cada linha, a partir de (máscara booleana, mensagem) na ordem de prioridade."""
+    errors = pd.Series('', index=frame.index)
+    for mask, message in checks:
+        errors = errors.mask(mask & (errors == ''), message)
+    return errors
+
+def existing_usernames(usernames):
+    """Quais dos nomes já estão cadastrados, consultando o índice do repositório de usuários."""
+    return pd.Series([user_store.exists(u) for u in usernames], index=usernames.index, dtype=bool)
+
+def import_patients(frame):
+    frame['status'] = frame['status'].replace('', 'active')
+    errors = import_errors(frame, [
+        (frame['username'] == '', "Nome de usuário vazio."),
+        (frame['username'].str.contains(UNSAFE_USERNAME_PATTERN, regex=True),
+         "Nome de usuário inválido (sem /, \\, caracteres de controle ou ponto inicial)."),
+        (frame['password'] == '', "Senha vazia."),
+        (~frame['status'].isin(['active', 'archived']), "Status inválido (use active ou archived)."),
+        (frame['username'].duplicated(), "Nome de usuário repetido no arquivo."),
+    ])
+    valid = errors == ''
+    errors = errors.mask(valid & existing_usernames(frame['username'].where(valid, '')), "Nome de usuário já existe.")
+    rows = frame[errors == '']
+    records = [dict(r, role='paciente') for r in rows.to_dict('records')]
+    imported = 0
+    row_of = dict(zip(rows['username'], rows.index))
+    for start in range(0, len(records), IMPORT_BATCH_SIZE):
+        batch = records[start:start + IMPORT_BATCH_SIZE]
+        # Nomes criados em paralelo desde a validação também são recusados pela inserção.
+        conflicts = user_store.add_many(batch)
+        for username in conflicts:
+            errors[row_of[username]] = "Nome de usuário já existe."
+        imported += len(batch) - len(conflicts)
+    return imported, errors
+
+def import_evolution(frame):
+    month = pd.to_numeric(frame['month'], errors='coerce')
+    values = frame[list(EVOLUTION_FIELDS)]
+    numeric = values.apply(lambda column: pd.to_numeric(column.str.replace(',', '.'), errors='coerce'))
+    errors = import_errors(frame, [
+        (frame['username'] == '', "Nome de usuário vazio."),
+        (frame['username'].str.contains(UNSAFE_USERNAME_PATTERN, regex=True),
+         "Nome de usuário inválido (sem /, \\, caracteres de controle ou ponto inicial)."),
+        (~month.isin(range(1, 13)), "Mês inválido (use 1 a 12)."),
+        (((values != '') & numeric.isna()).any(axis=1), "Medida não numérica."),
+        ((values == '').all(axis=1), "Nenhuma medida informada."),
+        (frame.duplicated(['username', 'month']), "Mês repetido para o mesmo paciente no arquivo."),
+    ])
+    valid = errors == ''
+    errors = errors.mask(valid & ~existing_usernames(frame['username'].where(valid, '')), "Paciente não encontrado.")
+    rows = frame[errors == '']
+    rows = rows.assign(month=month[rows.index].astype(int))
+    groups = list(rows.groupby('username', sort=False))
+    imported = 0
+    # Só os planos dos pacientes presentes no arquivo são regravados, um arquivo por paciente.
+    for start in range(0, len(groups), IMPORT_BATCH_SIZE):
+        with batched_plan_derivatives():
+            for username, group in groups[start:start + IMPORT_BATCH_SIZE]:
+                imported += import_patient_evolution(username, group, errors)
+    return imported, errors
+
+def import_patient_evolution(username, group, errors):
+    """Mescla as medidas do paciente no plano e grava. Retorna quantas linhas foram importadas."""
+    if not is_safe_username(username):
+        # Cadastros antigos podem ter nomes que não servem de nome de arquivo; nunca gravam fora da pasta.
+        errors[group.index] = "Nome de usuário inválido para gravar o plano."
+        return 0
+    data = load_plan_data(username)
+    if not data:
+        # Paciente ainda sem plano: começa com os mesmos campos que a tela de edição preencheria.
+        data = default_plan_data(username)
+    evolution = {int(entry['month']): entry for entry in data.get('evolution', [])}
+    for record in group.to_dict('records'):
+        entry = evolution.setdefault(record['month'], {'month': record['month'], **dict.fromkeys(EVOLUTION_FIELDS)})
+        entry.update({field: record[field] for field in EVOLUTION_FIELDS if record[field] != ''})
+    data['evolution'] = [evolution[m] for m in sorted(evolution)]
+    try:
+        persist_plan(username, data, expected_version=data.get('version', 0), changed={'evolution'})
+    except PlanVersionConflict as e:
+        errors[group.index] = f"{e} Importe novamente as linhas deste paciente."
+        return 0
+    return len(group)
+
+IMPORTERS = {'patients': import_patients, 'evolution': import_evolution}
+
+def run_import(stream, import_format, kind):
+    """Valida e grava o arquivo; retorna o relatório com os erros por linha."""
+    started = time.perf_counter()
+    frame = read_import_frame(stream, import_format, kind)
+    imported, errors = IMPORTERS[kind](frame)
+    failed = errors[errors != '']
+    return {
+        'kind': kind, 'rows': len(frame), 'imported': imported,
+        'errors': [{'row': int(row), 'username': frame.at[row, 'username'], 'error': message}
+                   for row, message in failed.items()],
+        'seconds': round(time.perf_counter() - started, 3),
     }
 
-    final_html = HTML_TEMPLATE_CLIENTE.format(**format_args)
-    
-    filepath = os.path.join(PATIENT_DATA_FOLDER, f"{username}.html")
-    with open(filepath, "w", encoding="utf-8") as f:
-        f.write(final_html)
+def import_format_for(filename, requested=None):
+    if requested:
+        return requested
+    return 'ndjson' if (filename or '').lower().endswith(('.ndjson', '.jsonl')) else 'csv'
 
-    flash(f"Plano do paciente '{username}' salvo com sucesso!", "success")
-    return redirect(url_for('dashboard'))
+@app.route('/import/<kind>', methods=['POST'])
+@login_required
+@nutritionist_required
+def import_data(kind):
+    """Importa pacientes ou medidas de evolução enviados no campo 'file' (CSV ou NDJSON)."""
+    upload = request.files.get('file')
+    import_format = request.args.get('format')
+    if kind not in IMPORTERS or upload is None or import_format not in (None, 'csv', 'ndjson'):
+        abort(400)
+    try:
+        report = run_import(upload.stream, import_format_for(upload.filename, import_format), kind)
+    except (ValueError, pd.errors.ParserError) as e:
+        return jsonify(error=f"Arquivo inválido: {e}"), 400
+    return jsonify(report)
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(list(IMPORTERS)))
+@click.argument('file', type=click.File('rb'))
+@click.option('--format', 'import_format', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='Formato do arquivo (padrão: pela extensão).')
+def import_command(kind, file, import_format):
+    """Importa pacientes ou medidas de evolução em lote a partir de CSV ou NDJSON."""
+    # A página do plano é renderizada com url_for, que precisa de um contexto de requisição.
+    with app.test_request_context():
+        report = run_import(file, import_format_for(file.name, import_format), kind)
+    for error in report['errors']:
+        click.echo(f"linha {error['row']} ({error['username']}): {error['error']}", err=True)
+    click.echo(f"{report['imported']} de {report['rows']} linhas importadas em {report['seconds']:.2f}s "
+               f"({len(report['errors'])} com erro).")
+
+# --- EXPORTAÇÃO DOS DADOS ---
+# A exportação é gerada aos poucos: usuários lidos em páginas pelo cursor do repositório e um plano
+# por vez, para que a memória não cresça com o número de pacientes.
+EXPORT_PAGE_SIZE = 500
+EXPORT_FORMATS = {'ndjson': ('application/x-ndjson', 'ndjson'), 'zip': ('application/zip', 'zip')}
+
+def iter_export_users(role=None, status=None):
+    """Usuários filtrados, em ordem de nome, sem carregar a lista inteira (nem as senhas)."""
+    after = None
+    while True:
+        page = user_store.query(role=role, status=status, sort='name', after=after, limit=EXPORT_PAGE_SIZE)
+        for row in page['rows']:
+            yield {'username': row['username'], 'role': row['role'], 'status': row['status']}
+        after = page['next_after']
+        if after is None:
+            break
+
+def export_plan(username):
+    return load_plan_data(username, backfill=False) or None
+
+def iter_export_ndjson(role=None, status=None):
+    """Uma linha JSON por usuário, com o plano embutido."""
+    for user in iter_export_users(role, status):
+        user['plan'] = export_plan(user['username'])
+        yield json.dumps(user, ensure_ascii=False, separators=(',', ':')).encode("utf-8") + b"\n"
+
+class _ExportBuffer(io.RawIOBase):
+    """Destino do ZipFile sem seek: acumula os bytes escritos até o gerador repassá-los."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+def iter_export_zip(role=None, status=None):
+    """Zip com patients.ndjson (usuários) e plans/<usuario>.json, gerado em fluxo."""
+    buffer = _ExportBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        info = zipfile.ZipInfo("patients.ndjson", time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(info, "w", force_zip64=True) as member:
+            for user in iter_export_users(role, status):
+                member.write(json.dumps(user, ensure_ascii=False, separators=(',', ':')).encode("utf-8") + b"\n")
+                yield buffer.drain()
+        for user in iter_export_users(role, status):
+            plan = export_plan(user['username'])
+            if plan:
+                archive.writestr(f"plans/{user['username']}.json", encode_plan_data(plan))
+                yield buffer.drain()
+    yield buffer.drain()
+
+def iter_export(export_format, role=None, status=None):
+    generator = iter_export_zip if export_format == 'zip' else iter_export_ndjson
+    # Trechos vazios (entradas ainda sendo comprimidas) não precisam virar pedaços da resposta.
+    return (chunk for chunk in generator(role, status) if chunk)
+
+@app.route('/export')
+@login_required
+@nutritionist_required
+def export_data():
+    """Exporta usuários e planos como NDJSON ou zip (?format=), com filtros ?status= e ?role=."""
+    export_format = request.args.get('format', 'ndjson')
+    status = request.args.get('status') or None
+    role = request.args.get('role') or None
+    if export_format not in EXPORT_FORMATS or status not in (None, 'active', 'archived') \
+            or role not in (None, 'paciente', 'nutricionista'):
+        abort(400)
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    # Sem Content-Length: a resposta sai em chunked transfer à medida que o gerador produz os dados.
+    response = Response(stream_with_context(iter_export(export_format, role, status)), mimetype=mimetype)
+    filename = f"portal-export-{datetime.now():%Y%m%d-%H%M%S}.{extension}"
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.cli.command('export')
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='ndjson', show_default=True)
+@click.option('--status', type=click.Choice(['active', 'archived']), default=None, help='Somente usuários com este status.')
+@click.option('--role', type=click.Choice(['paciente', 'nutricionista']), default=None, help='Somente usuários com este papel.')
+@click.option('--output', '-o', type=click.File('wb'), default='-', help='Arquivo de destino (padrão: saída padrão).')
+def export_command(export_format, status, role, output):
+    """Exporta usuários e planos como NDJSON ou zip."""
+    for chunk in iter_export(export_format, role, status):
+        output.write(chunk)
+    output.flush()
+
+# --- MANUTENÇÃO DOS PLANOS (CLI) ---
+plans_cli = AppGroup('plans', help='Manutenção dos arquivos de planos dos pacientes.')
+app.cli.add_command(plans_cli)
+
+PLANS_REBUILD_CHECKPOINT = os.path.join(app.instance_path, 'plans_rebuild.checkpoint')
+
+def iter_plan_usernames():
+    """Percorre a pasta de planos sem listar tudo em memória, devolvendo cada paciente uma única vez."""
+    seen = set()
+    with os.scandir(PATIENT_DATA_FOLDER) as entries:
+        for entry in entries:
+            for suffix in ('.json', '.html'):
+                if entry.name.endswith(suffix) and not entry.name.startswith('.'):
+                    username = entry.name[:-len(suffix)]
+                    if username not in seen:
+                        seen.add(username)
+                        yield username
+
+def rebuild_plan(username, dry_run=False, only_changed=False):
+    """Reextrai e re-renderiza o plano de um paciente, sob o lock do paciente.
+
+    Retorna (usuario, situação, derivados). A situação é 'written', 'unchanged', 'empty' ou
+    'error: ...'; derivados traz o resumo, as medidas de evolução e os textos indexados na busca,
+    gravados pelo processo principal.
+    """
+    try:
+        with plan_lock(username):
+            with app.test_request_context():
+                data = load_plan_data(username, backfill=False)
+                if not data:
+                    return username, 'empty', None
+                outputs = [(plan_json_path(username), encode_plan_data(data))]
+                derived = {'summary': build_plan_summary(data, len(outputs[0][1])), 'evolution': data.get('evolution', []),
+                           'search': plan_search_fields(data)}
+                if app.config['PLAN_RENDER_MODE'] != 'dynamic':
+                    outputs.append((plan_html_path(username), render_plan_html(data).encode("utf-8")))
+            if only_changed:
+                unchanged = True
+                for path, payload in outputs:
+                    if not os.path.exists(path):
+                        unchanged = False
+                        break
+                    with open(path, "rb") as f:
+                        if f.read() != payload:
+                            unchanged = False
+                            break
+                if unchanged:
+                    return username, 'unchanged', derived
+            if not dry_run:
+                atomic_write(plan_json_path(username), outputs[0][1])
+                if len(outputs) > 1:
+                    write_plan_page(username, outputs[1][1].decode("utf-8"))
+            return username, 'written', derived
+    except Exception as e:
+        return username, f'error: {e}', None
+
+def _rebuild_plan_worker(args):
+    return rebuild_plan(*args)
+
+@plans_cli.command('rebuild')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='Número de processos.')
+@click.option('--dry-run', is_flag=True, help='Apenas simula, sem gravar arquivos.')
+@click.option('--only-changed', is_flag=True, help='Regrava somente os planos cujo resultado mudou.')
+@click.option('--resume', is_flag=True, help='Continua uma execução interrompida a partir do checkpoint.')
+def plans_rebuild_command(workers, dry_run, only_changed, resume):
+    """Re-renderiza todos os planos em PATIENT_DATA_FOLDER em paralelo."""
+    done = set()
+    if resume and os.path.exists(PLANS_REBUILD_CHECKPOINT):
+        with open(PLANS_REBUILD_CHECKPOINT, encoding="utf-8") as f:
+            done = {line.rstrip('\n') for line in f}
+        click.echo(f"Retomando: {len(done)} planos já processados.")
+    elif not dry_run and os.path.exists(PLANS_REBUILD_CHECKPOINT):
+        os.remove(PLANS_REBUILD_CHECKPOINT)
+
+    tasks = ((username, dry_run, only_changed) for username in iter_plan_usernames() if username not in done)
+    counts = {}
+    pending_summaries, pending_evolutions, pending_search = {}, {}, {}
+    started = time.perf_counter()
+    checkpoint = None if dry_run else open(PLANS_REBUILD_CHECKPOINT, "a", encoding="utf-8")
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            for processed, (username, status, derived) in enumerate(pool.imap_unordered(_rebuild_plan_worker, tasks, chunksize=16), 1):
+                key = 'error' if status.startswith('error') else status
+                counts[key] = counts.get(key, 0) + 1
+                if key == 'error':
+                    click.echo(f"{username}: {status}", err=True)
+                elif checkpoint:
+                    checkpoint.write(username + '\n')
+                if derived and not dry_run:
+                    # Resumos e métricas são gravados pelo processo principal, em lotes, para não disputar os arquivos.
+                    pending_summaries[username] = derived['summary']
+                    pending_evolutions[username] = derived['evolution']
+                    pending_search[username] = (derived['search'], patient_status(username))
+                    if len(pending_summaries) >= 500:
+                        user_store.save_summaries(pending_summaries)
+                        metrics_store.update_many(pending_evolutions)
+                        search_index.update_many(pending_search)
+                        pending_summaries, pending_evolutions, pending_search = {}, {}, {}
+                if processed % 500 == 0:
+                    elapsed = time.perf_counter() - started
+                    click.echo(f"{processed} planos ({processed / elapsed:.1f} arquivos/s)")
+    finally:
+        if pending_summaries:
+            user_store.save_summaries(pending_summaries)
+            metrics_store.update_many(pending_evolutions)
+            search_index.update_many(pending_search)
+        if checkpoint:
+            checkpoint.close()
+
+    total = sum(counts.values())
+    elapsed = time.perf_counter() - started
+    if not dry_run and not counts.get('error'):
+        os.remove(PLANS_REBUILD_CHECKPOINT)
+    summary = ", ".join(f"{k}: {v}" for k, v in sorted(counts.items())) or "nenhum plano"
+    prefix = "[simulação] " if dry_run else ""
+    click.echo(f"{prefix}{total} planos em {elapsed:.2f}s ({total / elapsed if elapsed else 0:.1f} arquivos/s) — {summary}")
+
+@plans_cli.command('freeze-archived')
+def plans_freeze_archived_command():
+    """Move para o armazenamento frio os planos de pacientes arquivados que ainda estão em PATIENT_DATA_FOLDER."""
+    started = time.perf_counter()
+    patients = files = 0
+    for record in user_store.records(role='paciente', status='archived'):
+        moved = freeze_plan(record['username'])
+        if moved:
+            patients += 1
+            files += moved
+    click.echo(f"{patients} pacientes ({files} arquivos) movidos para {COLD_STORAGE_FOLDER} em {time.perf_counter() - started:.2f}s.")
+
+@plans_cli.command('analytics')
+@click.option('--status', type=click.Choice(['active', 'archived', 'all']), default='active', show_default=True)
+def plans_analytics_command(status):
+    """Estatísticas de evolução da clínica (médias, percentis, variações e pacientes piorando)."""
+    started = time.perf_counter()
+    result = clinic_evolution_analytics(status)
+    click.echo(json.dumps(result, ensure_ascii=False, indent=2))
+    click.echo(f"Calculado em {(time.perf_counter() - started) * 1000:.1f} ms.", err=True)
+
+# --- INICIALIZAÇÃO DOS WORKERS (PRELOAD) ---
+# Com "gunicorn --preload" (ver gunicorn.conf.py), o mestre chama warm_up() antes de criar os workers:
+# imports pesados, índice de usuários e templates compilados ficam prontos e são herdados por
+# copy-on-write, em vez de cada worker refazer tudo no primeiro acesso.
+STARTUP_MODULES = ('flask', 'numpy', 'pandas', 'bs4', 'app')
+
+def warm_up():
+    """Prepara o processo para o fork dos workers. Retorna o tempo gasto em cada etapa (s)."""
+    timings = {}
+    started = time.perf_counter()
+    np.ndarray, pd.DataFrame  # resolve os imports adiados
+    timings['imports'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    try:
+        for status in ('active', 'archived'):
+            user_store.query(role='paciente', status=status, limit=1)
+    except FileNotFoundError:
+        pass
+    timings['user_index'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    timings['templates'] = time.perf_counter() - started
+
+    # Objetos criados até aqui não são mais visitados pelo GC, que senão tocaria (e copiaria) suas páginas nos filhos.
+    gc.freeze()
+    return timings
+
+def measure_import(module, warm=False):
+    """Tempo de import (s) e RSS resultante de um módulo (e do warm_up(), se pedido), num interpretador novo."""
+    # O RSS vem de /proc/self/statm (Linux), lido sem importar mais nada depois do módulo medido.
+    code = ("import json, os, time; started = time.perf_counter(); import {module}; {warm}elapsed = time.perf_counter() - started\n"
+            "try: rss = int(open('/proc/self/statm').read().split()[1]) * os.sysconf('SC_PAGE_SIZE')\n"
+            "except (OSError, ValueError, AttributeError): rss = None\n"
+            "print(json.dumps([elapsed, rss]))")
+    result = subprocess.run([sys.executable, '-c', code.format(module=module, warm='app.warm_up(); ' if warm else '')],
+                            cwd=app.root_path, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
 
-def get_goal_icon(completed):
-    if completed:
-        return '<svg class="h-5 w-5 mr-3" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 20 20" fill="currentColor"><path fill-rule="evenodd" d="M10 18a8 8 0 100-16 8 8 0 000 16zm3.707-9.293a1 1 0 00-1.414-1.414L9 10.586 7.707 9.293a1 1 0 00-1.414 1.414l2 2a1 1 0 001.414 0l4-4z" clip-rule="evenodd" /></svg>'
-    return '<svg class="animate-spin h-5 w-5 mr-3 text-blue-400" xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24"><circle class="opacity-25" cx="12" cy="12" r="10" stroke="currentColor" stroke-width="4"></circle><path class="opacity-75" fill="currentColor" d="M4 12a8 8 0 018-8V0C5.373 0 0 5.373 0 12h4zm2 5.291A7.962 7.962 0 014 12H0c0 3.042 1.135 5.824 3 7.938l3-2.647z"></path></svg>'
+@app.cli.command('startup-report')
+def startup_report_command():
+    """Custo de import e memória de um worker, com e sem o aquecimento feito pelo --preload."""
+    click.echo(f"{'módulo':<22} {'tempo (ms)':>12} {'RSS (MB)':>10}")
+    for module in STARTUP_MODULES:
+        elapsed, rss = measure_import(module)
+        click.echo(f"{module:<22} {elapsed * 1000:>12.1f} {rss / 2**20 if rss else float('nan'):>10.1f}")
+    elapsed, rss = measure_import('app', warm=True)
+    click.echo(f"{'app + warm_up()':<22} {elapsed * 1000:>12.1f} {rss / 2**20 if rss else float('nan'):>10.1f}")
+    click.echo("Com --preload, o RSS de 'app + warm_up()' é feito uma vez no mestre e compartilhado com os workers "
+               "(veja o log do gunicorn para o RSS e a parte compartilhada de cada worker).")
 
 # --- EXECUTAR A APLICAÇÃO ---
 if __name__ == "__main__":
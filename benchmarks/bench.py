@@ -0,0 +1,398 @@
+"""Benchmarks do portal com dados sintéticos.
+
+    python benchmarks/bench.py generate --scale 10k
+    python benchmarks/bench.py run --scale 10k --mode client
+    python benchmarks/bench.py run --scale 10k --mode gunicorn --workers 4 --concurrency 8
+    python benchmarks/bench.py compare benchmarks/results/antes.json benchmarks/results/depois.json
+
+Os dados de cada escala ficam em benchmarks/data/<escala> (patients.csv e instance/) e o app é
+apontado para eles por PORTAL_USER_DB e PORTAL_INSTANCE_PATH, sem tocar nos dados reais.
+"""
+import csv
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+SCALES = {'100': 100, '10k': 10_000, '100k': 100_000}
+ARCHIVED_SHARE = 0.1
+NUTRITIONIST = ('bench-nutri', 'bench')
+PATIENT_PASSWORD = 'bench'
+
+SIGNALS = ['Insônia', 'Cansaço ao acordar', 'Inchaço', 'Ansiedade', 'Dor de cabeça', 'Compulsão por doces',
+           'Intestino preso', 'Azia', 'Queda de cabelo', 'Câimbras']
+SUPPLEMENTS = ['Creatina 5g', 'Whey protein', 'Ômega 3', 'Vitamina D', 'Magnésio', 'Probiótico', 'Colágeno']
+FOODS = ['arroz integral', 'feijão', 'frango', 'ovos', 'aveia', 'banana', 'batata-doce', 'brócolis', 'peixe',
+         'iogurte natural', 'castanhas', 'azeite']
+AVOID = ['refrigerante', 'açúcar refinado', 'embutidos', 'frituras', 'biscoitos recheados', 'fast food']
+GOALS = ['Beber 2L de água por dia', 'Dormir 8 horas', 'Treinar 4x por semana', 'Comer verduras no almoço',
+         'Evitar doces à noite', 'Tomar café da manhã']
+
+
+def scale_dir(scale):
+    return os.path.join(DATA_DIR, scale)
+
+
+def app_env(scale):
+    """Variáveis que apontam o app para os dados sintéticos da escala."""
+    directory = scale_dir(scale)
+    env = dict(os.environ)
+    env['PORTAL_USER_DB'] = os.path.join(directory, 'patients.csv')
+    env['PORTAL_INSTANCE_PATH'] = os.path.join(directory, 'instance')
+    env['FLASK_APP'] = 'app'
+    return env
+
+
+# --- GERAÇÃO DOS DADOS ---
+def synthetic_evolution(rng):
+    """Medidas mensais com tendência realista: gordura caindo, músculo subindo, alguns meses sem medida."""
+    months = rng.randint(1, 12)
+    fat, muscle = rng.uniform(18, 38), rng.uniform(22, 45)
+    water, metabolism = rng.uniform(45, 60), rng.uniform(1250, 2100)
+    evolution = []
+    for month in range(1, months + 1):
+        fat = max(8.0, fat + rng.gauss(-0.6, 0.5))
+        muscle = muscle + rng.gauss(0.25, 0.3)
+        water = min(70.0, max(40.0, water + rng.gauss(0.1, 0.6)))
+        metabolism = metabolism + rng.gauss(8, 15)
+        if rng.random() < 0.15:
+            continue  # consulta sem bioimpedância neste mês
+        entry = {'month': month, 'fat': f"{fat:.1f}", 'muscle': f"{muscle:.1f}", 'water': f"{water:.1f}",
+                 'metabolism': f"{metabolism:.0f}"}
+        if rng.random() < 0.1:
+            entry['water'] = ''
+        evolution.append(entry)
+    return evolution
+
+
+def synthetic_plan(rng, name):
+    evolution = synthetic_evolution(rng)
+    latest = evolution[-1] if evolution else {}
+    consultation = datetime(2025, 1, 1) + timedelta(days=rng.randint(0, 540))
+    return {
+        "name": name, "details": f"{rng.randint(18, 70)} anos, {rng.choice(['sedentário', 'ativo', 'atleta'])}",
+        "consultation_date": consultation.strftime('%d/%m/%Y'),
+        "bioimpedance": {"fat_percentage": latest.get('fat'), "muscle_mass": latest.get('muscle'),
+                         "water_percentage": latest.get('water'), "basal_metabolism": latest.get('metabolism'),
+                         "url": ""},
+        "habits": {"food_plan_text": "Café: " + ", ".join(rng.sample(FOODS, 3)) + "\nAlmoço: " + ", ".join(rng.sample(FOODS, 4)),
+                   "errors": "Pula refeições e consome " + rng.choice(AVOID), "improvements": "Mais " + rng.choice(FOODS),
+                   "url": ""},
+        "signals": rng.sample(SIGNALS, rng.randint(0, 4)),
+        "plan": {"substitutions_example": f"Trocar {rng.choice(AVOID)} por {rng.choice(FOODS)}",
+                 "supplements": rng.sample(SUPPLEMENTS, rng.randint(0, 3)),
+                 "shopping_prioritize": ", ".join(rng.sample(FOODS, 5)), "shopping_avoid": ", ".join(rng.sample(AVOID, 2))},
+        "results": {"prediction_text": "Redução de 3 a 5% de gordura em 3 meses"},
+        "goals": [{"text": text, "completed": rng.random() < 0.4} for text in rng.sample(GOALS, 3)],
+        "evolution": evolution,
+        "version": 1,
+    }
+
+
+@click.group()
+def cli():
+    """Benchmarks do portal com dados sintéticos."""
+
+
+@cli.command()
+@click.option('--scale', type=click.Choice(list(SCALES)), default='100', show_default=True)
+@click.option('--seed', default=42, show_default=True, help='Semente do gerador (dados reprodutíveis).')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='Processos do "flask plans rebuild".')
+def generate(scale, seed, workers):
+    """Gera patients.csv e os planos dos pacientes, e monta páginas, resumos e índices com o próprio app."""
+    directory = scale_dir(scale)
+    patient_folder = os.path.join(directory, 'instance', 'patient_data')
+    if os.path.exists(directory):
+        raise click.ClickException(f"{directory} já existe; apague a pasta para gerar de novo.")
+    os.makedirs(patient_folder)
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    with open(os.path.join(directory, 'patients.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['username', 'password', 'role', 'status'])
+        writer.writerow([NUTRITIONIST[0], NUTRITIONIST[1], 'nutricionista', ''])
+        for i in range(SCALES[scale]):
+            username = f"paciente{i:06d}"
+            status = 'archived' if rng.random() < ARCHIVED_SHARE else 'active'
+            writer.writerow([username, PATIENT_PASSWORD, 'paciente', status])
+            plan = synthetic_plan(rng, f"Paciente {i}")
+            with open(os.path.join(patient_folder, f"{username}.json"), 'w', encoding='utf-8') as plan_file:
+                json.dump(plan, plan_file, ensure_ascii=False, separators=(',', ':'))
+    click.echo(f"{SCALES[scale]} pacientes gerados em {time.perf_counter() - started:.1f}s.")
+
+    # Páginas, resumos, métricas e índice de busca saem do mesmo caminho usado em produção.
+    env = app_env(scale)
+    flask = [sys.executable, '-m', 'flask']
+    subprocess.run(flask + ['plans', 'rebuild', '--workers', str(workers)], cwd=REPO_DIR, env=env, check=True)
+    subprocess.run(flask + ['plans', 'freeze-archived'], cwd=REPO_DIR, env=env, check=True)
+
+
+# --- CLIENTES ---
+class TestClientSession:
+    """Sessão pelo test client do Flask, no próprio processo."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Cada requisição é medida sozinha; os redirecionamentos não são seguidos.
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HttpSession:
+    """Sessão HTTP (com cookies) contra um servidor local."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+# --- CENÁRIOS ---
+def quoted(username):
+    return urllib.parse.quote(username)
+
+
+def save_plan_form(rng, username):
+    plan = synthetic_plan(rng, username)
+    form = {'name': plan['name'], 'details': plan['details'], 'consultation_date': plan['consultation_date'],
+            'signals': "\n".join(plan['signals']), 'supplements': "\n".join(plan['plan']['supplements']),
+            'errors': plan['habits']['errors'], 'improvements': plan['habits']['improvements'],
+            'shopping_prioritize': plan['plan']['shopping_prioritize'], 'shopping_avoid': plan['plan']['shopping_avoid']}
+    for i, goal in enumerate(plan['goals']):
+        form[f'goal_text_{i}'] = goal['text']
+        if goal['completed']:
+            form[f'goal_completed_{i}'] = 'on'
+    for entry in plan['evolution']:
+        for field in ('fat', 'muscle', 'water', 'metabolism'):
+            form[f"evo_{field}_{entry['month']}"] = entry[field]
+    return form
+
+
+def scenario_requests(name, rng, patients):
+    """Requisições (método, caminho, formulário) de uma execução do cenário."""
+    username = rng.choice(patients)
+    if name == 'login':
+        return [('POST', '/login', {'username': NUTRITIONIST[0], 'password': NUTRITIONIST[1]})]
+    if name == 'dashboard':
+        return [('GET', '/dashboard', None)]
+    if name == 'archived_patients':
+        return [('GET', '/archived', None)]
+    if name == 'edit_plan':
+        return [('GET', f'/edit/{quoted(username)}', None)]
+    if name == 'save_plan':
+        return [('POST', f'/save_plan/{quoted(username)}', save_plan_form(rng, username))]
+    if name == 'archive_restore':
+        return [('GET', f'/archive/{quoted(username)}', None), ('GET', f'/restore/{quoted(username)}', None)]
+    raise ValueError(name)
+
+
+NUTRITIONIST_SCENARIOS = ['login', 'dashboard', 'archived_patients', 'edit_plan', 'save_plan', 'archive_restore']
+SCENARIOS = NUTRITIONIST_SCENARIOS + ['view_plan']
+
+
+def active_patients(scale):
+    with open(os.path.join(scale_dir(scale), 'patients.csv'), encoding='utf-8') as f:
+        return [r['username'] for r in csv.DictReader(f) if r['role'] == 'paciente' and r['status'] == 'active']
+
+
+def run_scenario(name, make_session, patients, iterations, concurrency, seed):
+    """Executa o cenário em `concurrency` sessões paralelas e devolve as latências (s) e os status HTTP."""
+    latencies, statuses = [], Counter()
+    window = [float('inf'), 0.0]  # início da primeira e fim da última requisição medida
+    lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(f"{seed}-{name}-{index}")
+        session = make_session()
+        if name == 'view_plan':
+            # Cada sessão é um paciente diferente vendo o próprio plano.
+            session.request('POST', '/login', {'username': rng.choice(patients), 'password': PATIENT_PASSWORD})
+            plan = lambda: [('GET', '/view', None)]
+        else:
+            if name != 'login':
+                session.request('POST', '/login', {'username': NUTRITIONIST[0], 'password': NUTRITIONIST[1]})
+            plan = lambda: scenario_requests(name, rng, patients)
+        # Uma execução sem medir aquece caches, templates e o CSV em memória de cada worker.
+        for method, path, data in plan():
+            session.request(method, path, data)
+        for _ in range(iterations // concurrency + (index < iterations % concurrency)):
+            for method, path, data in plan():
+                started = time.perf_counter()
+                status = session.request(method, path, data)
+                finished = time.perf_counter()
+                with lock:
+                    latencies.append(finished - started)
+                    window[0], window[1] = min(window[0], started), max(window[1], finished)
+                    statuses[str(status)] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return latencies, statuses, window[1] - window[0]
+
+
+def summarize(latencies, statuses, wall):
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies), 'errors': sum(n for status, n in statuses.items() if int(status) >= 400),
+        'statuses': dict(sorted(statuses.items())), 'seconds': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else None,
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2),
+        'p50_ms': round(cuts[49] * 1000, 2), 'p95_ms': round(cuts[94] * 1000, 2), 'p99_ms': round(cuts[98] * 1000, 2),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(scale, workers, preload=False):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}'] + (['--preload'] if preload else []) + ['app:app'],
+        cwd=REPO_DIR, env=app_env(scale), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise click.ClickException("O gunicorn terminou ao iniciar (está instalado?).")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise click.ClickException("O gunicorn não respondeu em 60s.")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@cli.command()
+@click.option('--scale', type=click.Choice(list(SCALES)), default='100', show_default=True)
+@click.option('--mode', type=click.Choice(['client', 'gunicorn']), default='client', show_default=True,
+              help='Test client do Flask no próprio processo, ou HTTP contra um gunicorn local.')
+@click.option('--workers', default=4, show_default=True, help='Workers do gunicorn.')
+@click.option('--preload', is_flag=True, help='Inicia o gunicorn com --preload (app aquecido no mestre).')
+@click.option('--concurrency', default=None, type=int, help='Sessões simultâneas (padrão: 1 no client, 2x workers no gunicorn).')
+@click.option('--requests', 'iterations', default=200, show_default=True, help='Execuções por cenário.')
+@click.option('--scenario', 'selected', multiple=True, type=click.Choice(SCENARIOS), help='Somente estes cenários.')
+@click.option('--seed', default=42, show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='Arquivo JSON do resultado.')
+def run(scale, mode, workers, preload, concurrency, iterations, selected, seed, output):
+    """Mede latência (p50/p95/p99) e vazão de cada rota e grava o resultado em JSON."""
+    if not os.path.exists(scale_dir(scale)):
+        raise click.ClickException(f"Dados da escala {scale} não encontrados; rode 'generate --scale {scale}' antes.")
+    patients = active_patients(scale)
+    server = None
+    if mode == 'client':
+        concurrency = concurrency or 1
+        os.environ.update({k: v for k, v in app_env(scale).items() if k.startswith('PORTAL_')})
+        sys.path.insert(0, REPO_DIR)
+        from app import app
+        make_session = lambda: TestClientSession(app)
+    else:
+        concurrency = concurrency or workers * 2
+        server, base_url = start_gunicorn(scale, workers, preload)
+        make_session = lambda: HttpSession(base_url)
+
+    results = {}
+    try:
+        for name in selected or SCENARIOS:
+            latencies, statuses, wall = run_scenario(name, make_session, patients, iterations, concurrency, seed)
+            results[name] = summarize(latencies, statuses, wall)
+            r = results[name]
+            click.echo(f"{name:<18} {r['throughput_rps']:>8} req/s  p50 {r['p50_ms']:>8} ms  p95 {r['p95_ms']:>8} ms  "
+                       f"p99 {r['p99_ms']:>8} ms  status {r['statuses']}")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = {
+        'scale': scale, 'patients': SCALES[scale], 'mode': mode, 'workers': workers if mode == 'gunicorn' else 1,
+        'preload': preload and mode == 'gunicorn',
+        'concurrency': concurrency, 'requests_per_scenario': iterations, 'seed': seed,
+        'revision': git_revision(), 'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'platform': platform.platform(),
+        'config': {k: v for k, v in os.environ.items() if k.startswith('PORTAL_') and k not in ('PORTAL_USER_DB', 'PORTAL_INSTANCE_PATH')},
+        'scenarios': results,
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{scale}-{mode}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    click.echo(f"Resultado gravado em {output}")
+
+
+@cli.command()
+@click.argument('baseline', type=click.File('r'))
+@click.argument('candidate', type=click.File('r'))
+@click.option('--threshold', default=10.0, show_default=True, help='Piora máxima aceita no p95 (%).')
+def compare(baseline, candidate, threshold):
+    """Compara dois resultados; termina com erro se algum p95 piorar mais que o limite."""
+    old, new = json.load(baseline), json.load(candidate)
+    regressions = []
+    click.echo(f"{'cenário':<18} {'req/s':>18} {'p50 (ms)':>22} {'p95 (ms)':>22} {'p99 (ms)':>22}")
+    for name, after in new['scenarios'].items():
+        before = old['scenarios'].get(name)
+        if before is None:
+            continue
+        columns = []
+        for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            change = (after[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            columns.append(f"{before[key]:>7} → {after[key]:<7} {change:+6.1f}%")
+        click.echo(f"{name:<18} " + " ".join(columns))
+        if before['p95_ms'] and (after['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 > threshold:
+            regressions.append(name)
+    if regressions:
+        raise click.ClickException(f"p95 piorou mais de {threshold}% em: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,60 @@
+"""Configuração do gunicorn, lida automaticamente quando ele é iniciado nesta pasta.
+
+    gunicorn -w 4 app:app              # cada worker importa o app e carrega pandas/NumPy sob demanda
+    gunicorn -w 4 --preload app:app    # o mestre aquece o app uma vez e os workers herdam por copy-on-write
+
+O log mostra o tempo de inicialização e a memória (RSS e parte compartilhada) de cada worker.
+"""
+import sys
+import time
+
+_MB = 2 ** 20
+
+
+def _portal():
+    # O app já está carregado no mestre (--preload) ou no worker; os ganchos nunca o importam por conta própria.
+    return sys.modules.get('app')
+
+
+def _format_memory(memory):
+    if memory['rss'] is None:
+        return "RSS indisponível"
+    shared = f", compartilhado {memory['shared'] / _MB:.1f} MB" if memory['shared'] is not None else ""
+    return f"RSS {memory['rss'] / _MB:.1f} MB{shared}"
+
+
+def when_ready(server):
+    portal = _portal()
+    if not server.cfg.preload_app or portal is None:
+        return
+    timings = portal.warm_up()
+    steps = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings.items())
+    server.log.info("App aquecido no mestre (%s); %s", steps, _format_memory(portal.process_memory()))
+
+
+def post_fork(server, worker):
+    worker.portal_forked_at = time.perf_counter()
+
+
+def post_worker_init(worker):
+    portal = _portal()
+    if portal is None:
+        return
+    elapsed = time.perf_counter() - worker.portal_forked_at
+    worker.log.info("Worker %s pronto em %.0f ms; %s", worker.pid, elapsed * 1000,
+                    _format_memory(portal.process_memory()))
+
+
+def worker_exit(server, worker):
+    # Gravações do write-behind e métricas pendentes não podem se perder quando o worker é reciclado.
+    portal = _portal()
+    if portal is not None:
+        portal.write_queue.flush()
+        portal.telemetry.flush()
+
+
+def child_exit(server, worker):
+    # Os totais do worker encerrado vão para instance/telemetry/retired.json (sem --preload, o /metrics faz isso).
+    portal = _portal()
+    if portal is not None:
+        portal.telemetry.retire(worker.pid)
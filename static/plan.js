@@ -0,0 +1,97 @@
+// Metadados dos indicadores, usados apenas por páginas antigas sem o endpoint de evolução.
+const METRIC_LABELS = {
+    fat: 'Gordura (%)',
+    muscle: 'Músculo (kg)',
+    water: 'Água (%)',
+    metabolism: 'Metabolismo (kcal)'
+};
+
+function seriesFromEmbeddedData() {
+    const dataScript = document.getElementById('patient-data');
+    if (!dataScript) return null;
+
+    const evolutionData = JSON.parse(dataScript.textContent).evolution || [];
+    const metrics = {};
+    Object.keys(METRIC_LABELS).forEach(key => {
+        metrics[key] = { label: METRIC_LABELS[key], data: evolutionData.map(d => parseFloat(d[key]) || 0) };
+    });
+    return { labels: evolutionData.map(d => 'Mês ' + d.month), metrics: metrics };
+}
+
+function showEmptyChart(container) {
+    container.innerHTML = '<p class="text-center text-gray-400">Nenhum dado de evolução mensal registrado.</p>';
+}
+
+function drawEvolutionChart(series) {
+    const ctx = document.getElementById('evolutionChart').getContext('2d');
+    const labels = series.labels;
+    const metrics = series.metrics;
+    const evolutionChart = new Chart(ctx, {
+        type: 'line',
+        data: {
+            labels: labels,
+            datasets: [{
+                label: 'Selecione um indicador',
+                data: [],
+                borderColor: '#3b82f6',
+                backgroundColor: 'rgba(59, 130, 246, 0.2)',
+                fill: true,
+                spanGaps: true,
+                tension: 0.1
+            }]
+        },
+        options: {
+            responsive: true,
+            scales: {
+                y: { beginAtZero: true, ticks: { color: '#cbd5e1' }, grid: { color: 'rgba(255, 255, 255, 0.1)' } },
+                x: { ticks: { color: '#cbd5e1' }, grid: { color: 'rgba(255, 255, 255, 0.1)' } }
+            },
+            plugins: { legend: { labels: { color: '#cbd5e1' } } }
+        }
+    });
+
+    const buttons = document.querySelectorAll('.chart-filter-btn');
+
+    function updateChart(metricKey) {
+        const metric = metrics[metricKey];
+        evolutionChart.data.datasets[0].label = metric.label;
+        evolutionChart.data.datasets[0].data = metric.data;
+        evolutionChart.update();
+
+        buttons.forEach(btn => {
+            btn.classList.toggle('active', btn.dataset.metric === metricKey);
+        });
+    }
+
+    buttons.forEach(button => {
+        button.addEventListener('click', () => {
+            updateChart(button.dataset.metric);
+        });
+    });
+
+    if(buttons.length > 0) {
+        updateChart(buttons[0].dataset.metric);
+    }
+}
+
+document.addEventListener('DOMContentLoaded', () => {
+    const container = document.getElementById('chart-container');
+    if (!container) return;
+
+    // O gráfico busca só as séries numéricas já calculadas pelo servidor (com ETag),
+    // em vez de reprocessar o JSON completo do plano embutido na página.
+    const evolutionUrl = container.dataset.evolutionUrl;
+    const loadSeries = evolutionUrl
+        ? fetch(evolutionUrl, { credentials: 'same-origin' }).then(response => response.ok ? response.json() : null)
+        : Promise.resolve(seriesFromEmbeddedData());
+
+    loadSeries
+        .then(series => {
+            if (!series || series.labels.length === 0) {
+                showEmptyChart(container);
+                return;
+            }
+            drawEvolutionChart(series);
+        })
+        .catch(() => showEmptyChart(container));
+});
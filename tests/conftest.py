@@ -0,0 +1,27 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def portal(tmp_path_factory):
+    # O app lê a pasta de dados e o CSV de usuários na importação; aponta ambos para uma pasta temporária.
+    data = tmp_path_factory.mktemp('portal')
+    shutil.copy(os.path.join(ROOT, 'patients.csv'), data / 'patients.csv')
+    os.environ['PORTAL_INSTANCE_PATH'] = str(data / 'instance')
+    os.environ['PORTAL_USER_DB'] = str(data / 'patients.csv')
+    sys.path.insert(0, ROOT)
+    import app
+    app.app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def nutritionist(portal):
+    client = portal.app.test_client()
+    client.post('/login', data={'username': 'nutricaio', 'password': 'nutricao25'})
+    return client
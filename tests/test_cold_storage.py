@@ -0,0 +1,14 @@
+import os
+
+
+def test_first_plan_of_archived_patient_goes_to_cold_storage(portal, nutritionist):
+    username = 'Arquivado Sem Plano'
+    nutritionist.post('/create_patient', data={'username': username, 'password': '123'})
+    nutritionist.get(f'/archive/{username}')
+    assert not portal.has_cold_plan(username)
+
+    nutritionist.post(f'/save_plan/{username}', data={'name': username, 'evo_fat_1': '20'})
+    assert portal.has_cold_plan(username)
+    assert not os.path.exists(portal.plan_json_path(username))
+    assert not os.path.exists(portal.plan_html_path(username))
+    assert portal.load_plan_data(username)['name'] == username
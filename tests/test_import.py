@@ -0,0 +1,40 @@
+import io
+import json
+import os
+
+import pytest
+
+UNSAFE = ['../../escaped', '..\\escaped', '.escaped', 'esc\x00aped', 'esc\naped']
+
+
+def upload(client, kind, records):
+    # NDJSON: ao contrário do CSV, preserva NUL e quebras de linha dentro do nome.
+    text = ''.join(json.dumps(record) + '\n' for record in records)
+    response = client.post(f'/import/{kind}', data={'file': (io.BytesIO(text.encode('utf-8')), f'{kind}.ndjson')})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_unsafe_usernames_are_rejected_and_nothing_escapes(portal, nutritionist):
+    names = UNSAFE + ['Importado Seguro']
+    report = upload(nutritionist, 'patients', [{'username': name, 'password': 'senha'} for name in names])
+    assert report['imported'] == 1
+    assert {error['row'] for error in report['errors']} == set(range(1, len(UNSAFE) + 1))
+    assert all('inválido' in error['error'] for error in report['errors'])
+
+    report = upload(nutritionist, 'evolution', [{'username': name, 'month': 1, 'fat': 20} for name in names])
+    assert report['imported'] == 1
+    assert len(report['errors']) == len(UNSAFE)
+
+    root = os.path.dirname(os.path.dirname(portal.PATIENT_DATA_FOLDER))
+    escaped = [os.path.join(folder, name) for folder, _, names in os.walk(os.path.dirname(root))
+               for name in names if 'escaped' in name]
+    assert escaped == []
+
+
+def test_plan_is_not_written_for_unsafe_existing_user(portal, nutritionist):
+    # Um nome inválido que já esteja cadastrado (ex.: editado à mão no CSV) também não grava plano.
+    portal.user_store.add('../fora', 'senha')
+    report = upload(nutritionist, 'evolution', [{'username': '../fora', 'month': 1, 'fat': 20}])
+    assert report['imported'] == 0
+    assert not os.path.exists(os.path.join(os.path.dirname(portal.PATIENT_DATA_FOLDER), 'fora.json'))
@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+USERNAME = 'Paciente Historico'
+
+
+@pytest.fixture
+def saved_plan(portal, nutritionist):
+    if not portal.user_store.exists(USERNAME):
+        nutritionist.post('/create_patient', data={'username': USERNAME, 'password': '123'})
+        nutritionist.post(f'/save_plan/{USERNAME}', data={'name': USERNAME})
+    return portal.plan_history.versions(USERNAME)[-1]
+
+
+def as_of(client, moment):
+    return client.get(f'/api/plan/{USERNAME}/history/as-of', query_string={'date': moment})
+
+
+@pytest.mark.parametrize('shift', [
+    lambda now: now.strftime('%Y-%m-%d'),
+    lambda now: now.strftime('%Y%m%d'),
+    lambda now: (now + timedelta(minutes=1)).strftime('%Y-%m-%d %H:%M'),
+    lambda now: (now + timedelta(seconds=1)).strftime('%Y-%m-%dT%H:%M:%S.250'),
+    lambda now: (now + timedelta(minutes=1)).astimezone().isoformat(timespec='minutes'),
+])
+def test_as_of_accepts_any_iso_format(nutritionist, saved_plan, shift):
+    response = as_of(nutritionist, shift(datetime.now()))
+    assert response.status_code == 200
+    assert response.get_json()['version'] == saved_plan['version']
+
+
+def test_as_of_before_first_save(nutritionist, saved_plan):
+    yesterday = datetime.now() - timedelta(days=1)
+    assert as_of(nutritionist, yesterday.strftime('%Y-%m-%d %H:%M')).status_code == 404
+    assert as_of(nutritionist, 'ontem').status_code == 400
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+USERNAME = 'Paciente Teste'
+
+
+@pytest.fixture
+def plan(portal, nutritionist):
+    if not portal.user_store.exists(USERNAME):
+        nutritionist.post('/create_patient', data={'username': USERNAME, 'password': '123'})
+        nutritionist.post(f'/save_plan/{USERNAME}', data={
+            'name': 'Paciente Teste', 'consultation_date': '01/02/2026', 'signals': 'cansaço',
+            'goal_text_0': 'beber água', 'evo_fat_1': '20', 'evo_muscle_1': '30'})
+    response = nutritionist.get(f'/api/plan/{USERNAME}')
+    assert response.status_code == 200
+    return response
+
+
+def stored_files(portal):
+    paths = [portal.plan_json_path(USERNAME), portal.plan_html_path(USERNAME)]
+    return {path: open(path, 'rb').read() for path in paths if os.path.exists(path)}
+
+
+@pytest.mark.parametrize('ops', [
+    [{'path': 'bioimpedance', 'value': 5}],
+    [{'path': 'habits', 'value': ['errado']}],
+    [{'path': 'signals', 'value': 'cansaço'}],
+    [{'path': 'goals', 'value': {'text': 'x'}}],
+    [{'path': 'goals[0].completed', 'value': 'sim'}],
+    [{'path': 'goals[0].text', 'value': 42}],
+    [{'path': 'evolution[month=1].fat', 'value': 'muito'}],
+    [{'path': 'evolution[month=1].fat', 'value': True}],
+    [{'path': 'evolution', 'value': [{'month': 13, 'fat': 20}]}],
+    [{'path': 'name', 'value': {'first': 'Paciente'}}],
+    [{'path': 'plan.supplements', 'value': 'creatina'}],
+])
+def test_patch_with_invalid_shape_is_rejected_before_writing(portal, nutritionist, plan, ops):
+    before = stored_files(portal)
+    response = nutritionist.patch(f'/api/plan/{USERNAME}', json={'ops': ops},
+                                  headers={'If-Match': plan.headers['ETag']})
+    assert response.status_code == 400
+    assert stored_files(portal) == before
+    assert nutritionist.get(f'/api/plan/{USERNAME}').headers['ETag'] == plan.headers['ETag']
+
+
+def test_goal_and_evolution_routes_validate_values(portal, nutritionist, plan):
+    etag = plan.headers['ETag']
+    response = nutritionist.patch(f'/api/plan/{USERNAME}/goals/0', json={'completed': 'on'}, headers={'If-Match': etag})
+    assert response.status_code == 400
+    response = nutritionist.patch(f'/api/plan/{USERNAME}/evolution/2', json={'fat': [1]}, headers={'If-Match': etag})
+    assert response.status_code == 400
+
+
+def test_valid_patch_is_applied(portal, nutritionist, plan):
+    ops = [{'path': 'goals[0].completed', 'value': True}, {'path': 'evolution[month=2]', 'value': {'fat': '19,5'}}]
+    response = nutritionist.patch(f'/api/plan/{USERNAME}', json={'ops': ops}, headers={'If-Match': plan.headers['ETag']})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['goals'][0]['completed'] is True
+    assert [entry['month'] for entry in data['evolution']] == [1, 2]
+
+
+def test_free_text_saved_by_the_form_does_not_block_other_patches(portal, nutritionist):
+    username = 'Paciente Texto Livre'
+    nutritionist.post('/create_patient', data={'username': username, 'password': '123'})
+    nutritionist.post(f'/save_plan/{username}', data={'name': username, 'goal_text_0': 'dormir', 'evo_fat_1': '20%'})
+    etag = nutritionist.get(f'/api/plan/{username}').headers['ETag']
+
+    response = nutritionist.patch(f'/api/plan/{username}/goals/0', json={'completed': True}, headers={'If-Match': etag})
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    response = nutritionist.patch(f'/api/plan/{username}/evolution/1', json={'water': '55'}, headers={'If-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['evolution'][0]['fat'] == '20%'
+    response = nutritionist.patch(f'/api/plan/{username}/evolution/1', json={'fat': '21%'},
+                                  headers={'If-Match': response.headers['ETag']})
+    assert response.status_code == 400
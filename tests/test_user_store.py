@@ -0,0 +1,15 @@
+import pytest
+
+
+def test_backends_implement_the_whole_interface(portal, tmp_path):
+    portal.CsvUserStore(str(tmp_path / 'patients.csv'), str(tmp_path / 'summaries.db'))
+    portal.SqliteUserStore(str(tmp_path / 'patients.db'))
+
+
+def test_incomplete_backend_fails_on_creation(portal):
+    class PartialStore(portal.UserStore):
+        def get(self, username):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialStore()
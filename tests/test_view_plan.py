@@ -0,0 +1,44 @@
+import os
+import shutil
+
+import pytest
+
+
+@pytest.mark.parametrize('mode', ['static', 'dynamic'])
+def test_patient_without_plan_sees_placeholder(portal, nutritionist, mode, monkeypatch):
+    username = f'Sem Plano {mode}'
+    nutritionist.post('/create_patient', data={'username': username, 'password': '123'})
+    monkeypatch.setitem(portal.app.config, 'PLAN_RENDER_MODE', mode)
+    client = portal.app.test_client()
+    client.post('/login', data={'username': username, 'password': '123'})
+    response = client.get('/view')
+    assert response.status_code == 200
+    assert 'Aguardando Plano' in response.get_data(as_text=True)
+
+
+def test_template_edit_reaches_dynamic_pages_without_restart(portal, nutritionist, monkeypatch, tmp_path):
+    from jinja2 import FileSystemLoader
+
+    templates = tmp_path / 'templates'
+    shutil.copytree(os.path.join(portal.app.root_path, 'templates'), templates)
+    monkeypatch.setattr(portal.app, 'template_folder', str(templates))
+    monkeypatch.setattr(portal.app, 'jinja_loader', FileSystemLoader(str(templates)))
+    monkeypatch.setitem(portal.app.config, 'PLAN_RENDER_MODE', 'dynamic')
+    assert not portal.app.jinja_env.auto_reload
+
+    username = 'Paciente Template'
+    nutritionist.post('/create_patient', data={'username': username, 'password': '123'})
+    nutritionist.post(f'/save_plan/{username}', data={'name': username})
+    client = portal.app.test_client()
+    client.post('/login', data={'username': username, 'password': '123'})
+    before = client.get('/view')
+    assert 'Marcador de teste' not in before.get_data(as_text=True)
+
+    template = templates / 'plan_cliente.html'
+    edited = tmp_path / 'edited.html'
+    edited.write_text(template.read_text(encoding='utf-8').replace('<body', '<!-- Marcador de teste --><body', 1),
+                      encoding='utf-8')
+    os.replace(edited, template)
+    after = client.get('/view')
+    assert after.headers['ETag'] != before.headers['ETag']
+    assert 'Marcador de teste' in after.get_data(as_text=True)